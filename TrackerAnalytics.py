@@ -0,0 +1,249 @@
+import heapq
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import TrackerStreak as Streak
+from TrackerHabit import to_array
+
+# bulk analytics over all habits
+# every habit is analysed from its streak summary, which is built once and kept up to date afterwards - with numpy
+# installed the summaries of all habits that have none yet are built at once - from the completion arrays of the habits
+# in memory, and from the day bitmaps in the save file for habits whose completions have not been read yet - otherwise
+# each habit builds its own from its day bitmaps; both give the same bitsets of completed periods
+# large datasets are split into chunks whose summaries are built in parallel by a pool of worker processes
+# streak queries (top_streaks, current_streaks) select from the ranked runs every habit keeps in its streak summary
+# with a heap, so only the streaks that make it into the result are looked at
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# number of worker processes (None: one per cpu) and the number of completions (or days of the day bitmaps) below
+# which the analysis stays in this process because sending the data to the workers would take longer than analysing it
+workers = None
+parallel_threshold = 200000
+
+# worker pool - started on the first parallel analysis and reused afterwards
+pool = None
+
+
+# returns the runs of complete periods for every habit - {habit name: [[first, last], ...]}
+def streak_runs(habits, now=None, vectorized=None):
+    if now is None:
+        now = Streak.to_seconds(datetime.now())
+    summarize(habits, vectorized)
+    return {name: habit.streak_state().streaks(now) for name, habit in habits.items()}
+
+
+# builds the streak summaries of the habits that have none yet with numpy - without numpy every habit builds its own
+# when it is first asked for it
+def summarize(habits, vectorized=None):
+    if vectorized is None:
+        vectorized = np is not None
+    bulk = uncached(habits)
+    if vectorized and bulk:
+        store_periods(habits, numpy_periods([bulk_entry(habit) for habit in bulk.values()]))
+
+
+# returns the habits without a streak summary whose day bitmaps or completions are at hand - the ones worth analysing
+# in bulk, the store computes the summaries of the others (sqlite)
+def uncached(habits):
+    return {name: habit for name, habit in habits.items()
+            if not habit.has_streak_state() and (habit.is_loaded() or habit.cached_bitmaps() is not None)}
+
+
+# describes a habit for the bulk analysis as (name, period, creation seconds, tasks) - the tasks are mapped to their
+# day bitmaps if the habit has them, otherwise to their completion arrays
+def bulk_entry(habit):
+    bitmaps = habit.cached_bitmaps()
+    tasks = bitmaps if bitmaps is not None else {task: habit.completions(task) for task in habit.tasks}
+    return habit.name, habit.period, habit.creation_seconds, tasks
+
+
+# keeps the period bitsets computed by the bulk analysis as the streak summaries of the habits
+def store_periods(habits, periods):
+    for name, tasks in periods.items():
+        habits[name].set_periods(tasks)
+
+
+# returns the runs of all habits like streak_runs - analyses the habits in the worker pool if there are enough
+# completions to make up for sending them to the workers
+def parallel_runs(habits, now=None, threshold=None):
+    global pool
+    if now is None:
+        now = Streak.to_seconds(datetime.now())
+    if threshold is None:
+        threshold = parallel_threshold
+    if workers == 1 or len(habits) < 2:
+        return streak_runs(habits, now)
+
+    # the day bitmaps or the compact completion arrays of the habits without a streak summary are sent to the workers,
+    # which return the period bitsets of their summaries
+    entries = [bulk_entry(habit) for habit in uncached(habits).values()]
+    sizes = {entry[0]: entry_size(entry) for entry in entries}
+    total = sum(sizes.values())
+    if total < threshold or len(entries) < 2:
+        return streak_runs(habits, now)
+    # views of a mapped save file cannot be sent and are copied
+    entries = [(name, period, start, {task: data if isinstance(data, Streak.DayBitmap) else to_array(data)
+                                      for task, data in tasks.items()}) for name, period, start, tasks in entries]
+
+    if pool is None:
+        pool = ProcessPoolExecutor(max_workers=workers)
+    # split the habits into a few chunks per worker with roughly the same number of completions each
+    chunks = [[]]
+    chunk_size = total // ((workers or os.cpu_count() or 1) * 4) + 1
+    size = 0
+    for entry in entries:
+        if size >= chunk_size:
+            chunks.append([])
+            size = 0
+        chunks[-1].append(entry)
+        size += sizes[entry[0]]
+
+    for periods in pool.map(analyze_chunk, chunks):
+        store_periods(habits, periods)
+    return {name: habit.streak_state().streaks(now) for name, habit in habits.items()}
+
+
+# returns the amount of data of a bulk entry - its completions, or the days covered by its day bitmaps
+def entry_size(entry):
+    return sum(len(data.days) * 8 if isinstance(data, Streak.DayBitmap) else len(data) for data in entry[3].values())
+
+
+# worker side of the parallel analysis - computes the period bitsets of the habits of a chunk
+def analyze_chunk(entries):
+    return numpy_periods(entries) if np is not None else python_periods(entries)
+
+
+# returns the longest streak in the runs of all habits as (habit name, first period, last period) - None if there
+# is none, streaks are compared in days and the first habit wins a tie
+def max_streak(habits, runs):
+    top_streak = None
+    top_days = 0
+    for name, data in runs.items():
+        for first, last in data:
+            days = (last - first + 1) * habits[name].period
+            if days > top_days:
+                top_streak = (name, first, last)
+                top_days = days
+    return top_streak
+
+
+# returns the k longest streaks over all habits as (habit name, [first period, last period]) - longest first, compared
+# in days, on a tie the habit that comes first and then its earlier streak win
+# period only looks at habits with that period, since and until (seconds) only at streaks that overlap that time
+# every habit offers its longest streak to a heap, and the habit of the streak taken from it offers its next longest
+def top_streaks(habits, k, now=None, period=None, since=None, until=None):
+    if now is None:
+        now = Streak.to_seconds(datetime.now())
+    summarize(habits if period is None else {name: habit for name, habit in habits.items() if habit.period == period})
+    heap = []
+    for order, habit in enumerate(habits.values()):
+        if period is not None and habit.period != period:
+            continue
+        ranked = habit.streak_state().ranked(now)[2]
+        if ranked:
+            heap.append(((ranked[0][0] - ranked[0][1] - 1) * habit.period, order, 0, habit, ranked))
+    heapq.heapify(heap)
+
+    result = []
+    while heap and len(result) < k:
+        days, order, position, habit, ranked = heap[0]
+        first, last = ranked[position]
+        if position + 1 < len(ranked):
+            following = ranked[position + 1]
+            heapq.heapreplace(heap, ((following[0] - following[1] - 1) * habit.period, order, position + 1, habit,
+                                     ranked))
+        else:
+            heapq.heappop(heap)
+        if overlaps(habit, first, last, since, until):
+            result.append((habit.name, [first, last]))
+    return result
+
+
+# returns True if a streak given by its first and last period overlaps the time from since until until (seconds,
+# None for no limit)
+def overlaps(habit, first, last, since, until):
+    period = habit.period * 86400
+    return (since is None or habit.creation_seconds + (last + 1) * period >= since) and \
+        (until is None or habit.creation_seconds + first * period <= until)
+
+
+# returns the streaks that are still going on as (habit name, [first period, last period]), longest first like
+# top_streaks - a streak goes on as long as it can be continued, so it may end with the current or the previous
+# period; k limits the result to the longest k streaks (None returns all)
+def current_streaks(habits, k=None, now=None, period=None):
+    if now is None:
+        now = Streak.to_seconds(datetime.now())
+    summarize(habits if period is None else {name: habit for name, habit in habits.items() if habit.period == period})
+    entries = []
+    for order, habit in enumerate(habits.values()):
+        if period is not None and habit.period != period:
+            continue
+        count, runs, ranked = habit.streak_state().ranked(now)
+        if runs and runs[-1][1] >= count - 2:
+            entries.append(((runs[-1][0] - runs[-1][1] - 1) * habit.period, order, habit.name, runs[-1]))
+    entries = sorted(entries) if k is None else heapq.nsmallest(k, entries)
+    return [(name, run) for days, order, name, run in entries]
+
+
+# returns the longest streak over all habits like max_streak - taken from the streak summaries, which are built once
+# for the habits that do not have one yet and kept up to date afterwards, so repeated queries do not grow with history
+def longest_streak(habits):
+    top = top_streaks(habits, 1)
+    return (top[0][0], top[0][1][0], top[0][1][1]) if top else None
+
+
+# computes the period bitsets of every task of the bulk entries one habit at a time - {habit name: {task: bitset}}
+def python_periods(entries):
+    return {name: {task: day_bitmap(data, start).periods(period) for task, data in tasks.items()}
+            for name, period, start, tasks in entries}
+
+
+# returns the day bitmap of a task given by its day bitmap or its completions
+def day_bitmap(data, start):
+    return data if isinstance(data, Streak.DayBitmap) else Streak.day_bitmap(data, start)
+
+
+# computes the period bitsets of every task of the bulk entries with numpy - {habit name: {task: bitset}}
+# day bitmaps are bitsets already and are turned into period bitsets with a few operations on python ints, which is
+# faster than unpacking their bits; all completions become offsets from the creation date of their habit, np.divmod
+# turns them into period indices, a completion exactly on a boundary also counts for the period before, and the indices
+# of every task are set in one bool array that is packed into the bytes of its bitset
+def numpy_periods(entries):
+    result = {name: {} for name, period, start, tasks in entries}
+    names = []
+    periods = []
+    owners = [np.zeros(0, dtype=np.int64)]
+    offsets = [np.zeros(0, dtype=np.int64)]
+    for name, period, start, tasks in entries:
+        for task, data in tasks.items():
+            if isinstance(data, Streak.DayBitmap):
+                result[name][task] = data.periods(period)
+                continue
+            stamps = np.frombuffer(data, dtype=np.int64)
+            owners.append(np.full(len(stamps), len(names), dtype=np.int64))
+            offsets.append(stamps - start)
+            names.append((name, task))
+            periods.append(period * 86400)
+    owners = np.concatenate(owners)
+    offsets = np.concatenate(offsets)
+    keep = offsets >= 0
+    owners = owners[keep]
+    index, rest = np.divmod(offsets[keep], np.array(periods, dtype=np.int64)[owners])
+    boundary = (rest == 0) & (index > 0)
+    owners = np.concatenate((owners, owners[boundary]))
+    index = np.concatenate((index, index[boundary] - 1))
+
+    # every task gets whole bytes, so its bitset is one slice of the packed bits
+    width = np.zeros(len(names), dtype=np.int64)
+    np.maximum.at(width, owners, index + 1)
+    width = (width + 7) // 8
+    base = np.cumsum(width) - width
+    bits = np.zeros(int(width.sum()) * 8, dtype=bool)
+    bits[base[owners] * 8 + index] = True
+    packed = np.packbits(bits, bitorder='little').tobytes()
+    for (name, task), first, length in zip(names, base.tolist(), width.tolist()):
+        result[name][task] = int.from_bytes(packed[first:first + length], 'little')
+    return result
@@ -0,0 +1,45 @@
+import csv
+import json
+import TrackerExceptions as Exceptions
+from TrackerTime import parse_timestamp
+
+# readers for bulk check-in imports
+# csv files have one habit,task,timestamp row per completion (an optional header row is skipped),
+# jsonl files have one {"habit": ..., "task": ..., "time": ...} object per line
+# timestamps are either epoch seconds or Y-m-d H:M:S strings
+
+
+# converts an imported timestamp into epoch seconds
+def to_stamp(value):
+    if isinstance(value, int):
+        return value
+    value = value.strip()
+    return int(value) if value.isdigit() else parse_timestamp(value)
+
+
+# yields (habit, task, timestamp) tuples from a csv or jsonl file
+def read_events(path):
+    with open(path, newline='') as f:
+        if path.endswith('.jsonl') or path.endswith('.json'):
+            for line in f:
+                if line.strip():
+                    event = json.loads(line)
+                    yield event['habit'], event['task'], event['time']
+        else:
+            for number, row in enumerate(csv.reader(f), 1):
+                if not row:
+                    continue
+                if number == 1 and [x.strip().lower() for x in row] == ['habit', 'task', 'timestamp']:
+                    continue
+                if len(row) != 3:
+                    raise Exceptions.SaveFileError('Line ' + str(number) + ' of ' + path +
+                                                   ' is not habit,task,timestamp')
+                yield row[0], row[1], row[2]
+
+
+# reads all events of a file and groups the epoch seconds by (habit, task)
+def group_events(path):
+    groups = {}
+    for habit, task, stamp in read_events(path):
+        groups.setdefault((habit, task), []).append(to_stamp(stamp))
+    return groups
@@ -13,3 +13,7 @@ class ElementAlreadyExists(Exception):
 
 class IncompleteHabit(Exception):
     pass
+
+
+class SaveFileError(Exception):
+    pass
@@ -1,9 +1,35 @@
-from datetime import datetime, timedelta
+import bisect
+import heapq
+import sys
+from array import array
+from collections.abc import MutableMapping, Sequence
+from datetime import datetime
 import TrackerExceptions as Exceptions
+import TrackerStats as Stats
+import TrackerStreak as Streak
+from TrackerTime import format_timestamp, parse_timestamp, period_boundary
+
+
+# builds the compact, sorted completion array of a task - accepts epoch seconds and timestamp strings
+def to_completions(values):
+    return array('q', sorted(parse_timestamp(x) if isinstance(x, str) else int(x) for x in values))
+
+
+# copies completions given as a memoryview (or any int64 buffer) into an array
+def to_array(stamps):
+    if isinstance(stamps, array):
+        return stamps
+    copy = array('q')
+    copy.frombytes(memoryview(stamps).cast('B'))
+    return copy
 
 
 # main habit class to define habit structure
+# habits use __slots__ and keep the creation date as seconds since the epoch - tens of thousands of habits are kept in
+# memory, so every habit avoids an instance dict and the creation date is not parsed again for every analysis
 class Habit:
+    __slots__ = ('name', '_period', '_start', '_tasks', '_streaks', '_bitmaps')
+
     def __init__(self, name, period):
         # input check name
         if not isinstance(name, str):
@@ -18,78 +44,268 @@ class Habit:
         if not period < 365:
             raise Exceptions.HabitTypeError("The Habit's period must be an integer between 0 and 365!x")
 
-        self.period = period
+        # cached streak summary and per-task day bitmaps - built on the first analysis and kept up to date afterwards
+        self._streaks = None
+        self._bitmaps = None
+        self._period = period
         self.name = name
-        self.creation_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self._start = Streak.to_seconds(datetime.now())
         self.tasks = {}
 
+    # changing the period or creation date moves every period boundary - the streak cache has to be rebuilt,
+    # the day bitmaps only depend on the creation date
+    @property
+    def period(self):
+        return self._period
+
+    @period.setter
+    def period(self, period):
+        self._period = period
+        self._streaks = None
+
+    # the creation date is read and written as a timestamp string and stored in seconds
+    @property
+    def creation_date(self):
+        return format_timestamp(self._start)
+
+    @creation_date.setter
+    def creation_date(self, creation_date):
+        self.creation_seconds = parse_timestamp(creation_date)
+
+    @property
+    def creation_seconds(self):
+        return self._start
+
+    @creation_seconds.setter
+    def creation_seconds(self, seconds):
+        self._start = seconds
+        self._streaks = None
+        self._bitmaps = None
+
+    # tasks are stored in a TaskMap so replacing the completions of a task updates the streak cache
+    @property
+    def tasks(self):
+        return self._tasks
+
+    @tasks.setter
+    def tasks(self, tasks):
+        self._tasks = TaskMap(self, tasks)
+        self._streaks = None
+        self._bitmaps = None
+
     # adds a task to the habit
     def add_task(self, name):
         if name in self.tasks:
             raise Exceptions.ElementAlreadyExists('This Task already exists!')
         else:
             self.tasks[name] = []
-            print('Added task ' + name + ' to Habit ' + self.name)
 
     # removes a task from the habit
     def remove_task(self, name):
         if name in self.tasks:
             del self.tasks[name]
-            print('Task ' + name + ' in Habit ' + self.name + ' has been removed')
         else:
             raise Exceptions.ElementNotFound('There is no task with that name!')
 
-    # "checks off" a task - adds the current timestamp to the array of the respective task
-    def check_task(self, name):
+    # "checks off" a task - adds the current timestamp (or the given epoch seconds) to the array of the respective task
+    # returns the epoch seconds that were stored
+    def check_task(self, name, stamp=None):
+        if stamp is None:
+            stamp = Streak.to_seconds(datetime.now())
+        self.add_completion(name, stamp)
+        return stamp
+
+    # stores a completion - used when replaying saved data
+    def add_completion(self, name, stamp):
+        if name not in self.tasks:
+            raise Exceptions.ElementNotFound('There is no task with that name!')
+        bisect.insort(self._tasks.mutable(name), stamp)
+        if self._bitmaps is not None:
+            self._bitmaps[name].add(stamp - self._start)
+        if self._streaks is not None:
+            self._streaks.add_completion(name, stamp)
+
+    # stores many completions of a task at once - the sorted run is appended or merged into the completion array
+    def add_completions(self, name, stamps):
         if name not in self.tasks:
             raise Exceptions.ElementNotFound('There is no task with that name!')
+        stamps = sorted(stamps)
+        current = self._tasks.mutable(name)
+        if not current or not stamps or stamps[0] >= current[-1]:
+            current.extend(stamps)
         else:
-            self.tasks[name].append(datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-            print('Checked Task')
+            current[:] = array('q', heapq.merge(current, stamps))
+        if self._bitmaps is not None:
+            for stamp in stamps:
+                self._bitmaps[name].add(stamp - self._start)
+        if self._streaks is not None:
+            for stamp in stamps:
+                self._streaks.add_completion(name, stamp)
+
+    # returns the sorted completion array (seconds since the epoch) of a task - a read-only memoryview for habits loaded
+    # from a binary snapshot that have not been changed since
+    def completions(self, name):
+        return self.tasks.stamps(name)
+
+    # sets the task names of a habit whose completions stay in the save file until the habit is first used
+    # the loader provides completions() and optionally a streak summary computed by the store
+    def defer_tasks(self, names, loader):
+        self.tasks = {}
+        self._tasks.data = dict.fromkeys(sys.intern(name) for name in names)
+        self._tasks.loader = loader
+
+    # returns False while the completions of the habit have not been read from the save file
+    def is_loaded(self):
+        return self._tasks.loader is None
 
     # returns a list of all tasks currently set for the habit
     def get_all_tasks(self):
-        print(list(iter(self.tasks)))
-        return
+        return list(self.tasks)
+
+    # returns the day bitmaps of all tasks - read from the save file, or built from the stored timestamps if the
+    # save file has none
+    def day_bitmaps(self):
+        if self.cached_bitmaps() is None:
+            self._bitmaps = {name: Streak.day_bitmap(self.completions(name), self._start) for name in self.tasks}
+            if Stats.enabled:
+                Stats.count('completions indexed', sum(len(self.completions(name)) for name in self.tasks))
+        return self._bitmaps
+
+    # returns the day bitmaps if they can be had without reading the completions - built before or stored in the save
+    # file of a habit that is not loaded, None otherwise
+    def cached_bitmaps(self):
+        if self._bitmaps is None and not self.is_loaded():
+            bitmaps = self._tasks.loader.bitmaps(self.creation_date)
+            if bitmaps is not None and list(bitmaps) == list(self.tasks):
+                self._bitmaps = bitmaps
+        return self._bitmaps
+
+    # builds the streak cache from the day bitmaps - or lets the store compute it if the habit is not loaded
+    def streak_state(self):
+        if self._streaks is None:
+            if not self.is_loaded():
+                self._streaks = self._tasks.loader.streak_state(self._start, self.period * 86400, list(self.tasks))
+            if self._streaks is None:
+                self.set_periods({name: bitmap.periods(self.period) for name, bitmap in self.day_bitmaps().items()})
+            elif Stats.enabled:
+                Stats.count('periods indexed', sum(bin(bits).count('1') for bits in self._streaks.tasks.values()))
+        return self._streaks
+
+    # sets the streak cache from the bitsets of the periods every task has been done in - the bulk analysis computes
+    # them for many habits at once
+    def set_periods(self, periods):
+        self._streaks = Streak.StreakState(self._start, self.period * 86400)
+        for name in self.tasks:
+            self._streaks.set_periods(name, periods[name])
+        if Stats.enabled:
+            Stats.count('periods indexed', sum(bin(bits).count('1') for bits in self._streaks.tasks.values()))
+
+    # returns True if the streak summary has been built and is kept up to date
+    def has_streak_state(self):
+        return self._streaks is not None
+
+    # refreshes the cached completions of a single task
+    def _update_task(self, name):
+        if self._bitmaps is not None:
+            self._bitmaps[name] = Streak.day_bitmap(self.completions(name), self._start)
+        if self._streaks is not None:
+            self._streaks.set_task(name, self.completions(name))
+
+    # removes a task from the streak cache
+    def _drop_task(self, name):
+        if self._bitmaps is not None:
+            del self._bitmaps[name]
+        if self._streaks is not None:
+            self._streaks.remove_task(name)
 
     # analysis module core - computes all streaks achieved for the habit
+    # returns a list of [streak start, duration in periods, streak end] entries
     def calculate_streak(self):
-        completions = []
-        # convert task timestamps to datetime objects and store in array
-        for n in self.tasks.items():
-            task_completions = [datetime.strptime(x, '%Y-%m-%d %H:%M:%S') for x in n[1]]
-            completions.append(task_completions)
-
-        # init variables used for analysis below
-        step = datetime.strptime(self.creation_date, '%Y-%m-%d %H:%M:%S')
-        active_streak = False
-        streak_start = None
-        streak_duration = 0
-        analysis_data = []
-
-        # while loop to step through the time periods being analyzed
-        while step <= datetime.now():
-            # function to check if a timestamp is between the current step and step + period
-            is_between = lambda dt: step <= dt <= step + timedelta(days=self.period)
-
-            # generator expression to check if for the current period, every task has been completed at least once
-            analyse_cache = sum(any(is_between(dt) for dt in x) for x in completions)
-            # check if current period is a streak
-            if analyse_cache == len(completions) and not active_streak:
-                streak_start = step
-                streak_duration += 1
-                active_streak = True
-            elif analyse_cache == len(completions) and active_streak:
-                streak_duration += 1
-            elif analyse_cache != len(completions) and active_streak:
-                streak_end = step
-                active_streak = False
-                analysis_data.append([streak_start, streak_duration, streak_end])
-                streak_duration = 0
-            step += timedelta(days=self.period)
-        # check if streak is still active after loop - if write to array (ongoing streak)
-        if active_streak:
-            streak_end = step
-            analysis_data.append([streak_start, streak_duration, streak_end])
-
-        return analysis_data
+        data = self.streak_state().streaks(Streak.to_seconds(datetime.now()))
+        if Stats.enabled:
+            Stats.count('streak runs scanned', len(data))
+        return self.to_streaks(data)
+
+    # converts [first, last] runs of period indices into [streak start, duration in periods, streak end] entries
+    def to_streaks(self, data):
+        return [[period_boundary(self._start, self.period, first), last - first + 1,
+                 period_boundary(self._start, self.period, last + 1)] for first, last in data]
+
+
+# mapping of task names to their completions - reports replaced and removed tasks to the habit
+# completions are stored as sorted arrays of epoch seconds and read back as timestamp strings
+# task names are always in memory, the completions of a lazily loaded habit are read on first access
+# task names are interned - habits usually share a few task names, which are then stored only once
+class TaskMap(MutableMapping):
+    __slots__ = ('habit', 'loader', 'data')
+
+    def __init__(self, habit, tasks):
+        self.habit = habit
+        self.loader = None
+        self.data = {sys.intern(name): to_completions(values) for name, values in tasks.items()}
+
+    # reads the completions of all tasks from the save file if that has not happened yet
+    def hydrate(self):
+        if self.loader is not None:
+            loader, self.loader = self.loader, None
+            self.data.update(loader.completions())
+
+    # returns the completion array of a task
+    def stamps(self, name):
+        self.hydrate()
+        return self.data[name]
+
+    # returns the completion array of a task for changing it - completions that are still a view of a mapped save
+    # file are copied first
+    def mutable(self, name):
+        stamps = self.stamps(name)
+        if not isinstance(stamps, array):
+            stamps = self.data[name] = to_array(stamps)
+        return stamps
+
+    # copies all completions that are still views of a mapped save file, so the file can be closed
+    def detach(self):
+        self.hydrate()
+        for name in self.data:
+            self.mutable(name)
+
+    def __getitem__(self, name):
+        return CompletionView(self.stamps(name))
+
+    def __setitem__(self, name, completions):
+        self.hydrate()
+        self.data[sys.intern(name)] = to_completions(completions)
+        self.habit._update_task(name)
+
+    def __delitem__(self, name):
+        self.hydrate()
+        del self.data[name]
+        self.habit._drop_task(name)
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return repr({name: list(self[name]) for name in self})
+
+
+# read-only view of a task's completions that yields the formatted timestamp strings
+class CompletionView(Sequence):
+    __slots__ = ('stamps',)
+
+    def __init__(self, stamps):
+        self.stamps = stamps
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [format_timestamp(x) for x in self.stamps[index]]
+        return format_timestamp(self.stamps[index])
+
+    def __len__(self):
+        return len(self.stamps)
+
+    def __repr__(self):
+        return repr(list(self))
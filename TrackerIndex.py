@@ -0,0 +1,113 @@
+import bisect
+
+# secondary indexes over the habits - kept up to date from the change records and rebuilt when a save file is loaded
+# period -> habit names and task name -> habit names are dicts used as insertion ordered sets
+# the completion index maps a day (days since the epoch) to the sorted (timestamp, habit, task) tuples of that day,
+# it needs the completions of every habit and is therefore only built on the first date query
+
+
+class HabitIndex:
+    def __init__(self):
+        # habit name -> (period, {task name: None})
+        self.habits = {}
+        self.periods = {}
+        self.tasks = {}
+        # completion index - days is None until the index is built, day_list holds the days in order and task_days
+        # the days with a completion of every (habit, task) pair
+        self.days = None
+        self.day_list = []
+        self.task_days = {}
+
+    # drops everything and indexes the habits again - the completion index is built on the next date query
+    def rebuild(self, habits):
+        self.__init__()
+        for habit in habits.values():
+            self.add_habit(habit.name, habit.period, habit.tasks)
+
+    def add_habit(self, name, period, tasks=()):
+        self.habits[name] = (period, {})
+        self.periods.setdefault(period, {})[name] = None
+        for task in tasks:
+            self.add_task(name, task)
+
+    def remove_habit(self, name):
+        period, tasks = self.habits[name]
+        for task in list(tasks):
+            self.remove_task(name, task)
+        del self.habits[name]
+        del self.periods[period][name]
+        if not self.periods[period]:
+            del self.periods[period]
+
+    def add_task(self, habit, task):
+        self.habits[habit][1][task] = None
+        self.tasks.setdefault(task, {})[habit] = None
+
+    def remove_task(self, habit, task):
+        del self.habits[habit][1][task]
+        del self.tasks[task][habit]
+        if not self.tasks[task]:
+            del self.tasks[task]
+        if self.days is not None:
+            for day in self.task_days.pop((habit, task), ()):
+                bucket = [entry for entry in self.days[day] if entry[1] != habit or entry[2] != task]
+                if bucket:
+                    self.days[day] = bucket
+                else:
+                    del self.days[day]
+                    del self.day_list[bisect.bisect_left(self.day_list, day)]
+
+    def add_completions(self, habit, task, stamps):
+        if self.days is None:
+            return
+        days = self.task_days.setdefault((habit, task), set())
+        for stamp in stamps:
+            day = stamp // 86400
+            if day not in self.days:
+                self.days[day] = []
+                bisect.insort(self.day_list, day)
+            bisect.insort(self.days[day], (stamp, habit, task))
+            days.add(day)
+
+    # updates the indexes with a change record (see TrackerStorage.apply_record)
+    def apply(self, record):
+        operation = record['op']
+        if operation == 'addHabit':
+            self.add_habit(record['name'], int(record['period']))
+            for task, stamps in record.get('tasks', {}).items():
+                self.add_task(record['name'], task)
+                self.add_completions(record['name'], task, stamps)
+        elif operation == 'removeHabit':
+            self.remove_habit(record['name'])
+        elif operation == 'addTask':
+            self.add_task(record['habit'], record['task'])
+        elif operation == 'removeTask':
+            self.remove_task(record['habit'], record['task'])
+        elif operation == 'checkTask':
+            self.add_completions(record['habit'], record['task'], (record['time'],))
+        elif operation == 'importCompletions':
+            self.add_completions(record['habit'], record['task'], record['times'])
+
+    # builds the completion index from the completions of all habits
+    def build_days(self, habits):
+        self.days = {}
+        for habit in habits.values():
+            for task in habit.tasks:
+                self.add_completions(habit.name, task, habit.completions(task))
+
+    # returns the (timestamp, habit, task) tuples of all completions from the first to the last day (inclusive)
+    def completions_between(self, habits, first, last):
+        if self.days is None:
+            self.build_days(habits)
+        result = []
+        for position in range(bisect.bisect_left(self.day_list, first), bisect.bisect_right(self.day_list, last)):
+            result.extend(self.days[self.day_list[position]])
+        return result
+
+    # returns the names of all habits that have a task with the given name
+    def habits_with_task(self, task):
+        return list(self.tasks.get(task, ()))
+
+    # returns (period, habit names) for every period in ascending order
+    def habits_by_period(self):
+        return [(period, list(self.periods[period])) for period in sorted(self.periods)]
@@ -0,0 +1,214 @@
+import json
+import sys
+from datetime import datetime
+import TrackerStats as Stats
+import TrackerTime as Time
+
+# output layer - the tracker operations return results instead of printing, the results are rendered here
+# human: the messages of the command line, json: one json object per result and line, quiet: errors only
+# everything a command or a batch produces is collected in one buffer and written at once when it is done, results
+# of programmatic calls that are never emitted are not formatted at all
+
+# global Error / Warning sign
+err = '[Error]'
+war = '[Warning] '
+
+modes = ('human', 'json', 'quiet')
+mode = 'human'
+
+# rendered lines waiting to be written, their size and the number of open command / batch scopes
+buffer = []
+buffered_size = 0
+depth = 0
+
+# buffered characters above which the buffer is written before the scope ends, so long batches do not pile up
+flush_threshold = 64 * 1024
+
+
+# outcome of an operation - kind names what happened ('habitAdded', 'error', ...), data holds json compatible fields
+class Result:
+    __slots__ = ('kind', 'data')
+
+    def __init__(self, kind, **data):
+        self.kind = kind
+        self.data = data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __eq__(self, other):
+        return isinstance(other, Result) and self.kind == other.kind and self.data == other.data
+
+    def __repr__(self):
+        return 'Result(' + repr(self.kind) + ', ' + repr(self.data) + ')'
+
+    # False for errors
+    @property
+    def ok(self):
+        return self.kind != 'error'
+
+
+def error(message):
+    return Result('error', message=message)
+
+
+# converts a streak ([start, periods, end]) of a habit into its json form
+def streak_data(habit, streak):
+    return {'start': Time.format_datetime(streak[0]), 'periods': streak[1],
+            'days': streak[1] * habit.period, 'end': Time.format_datetime(streak[2]),
+            'ongoing': streak[2] > datetime.now()}
+
+
+# collects everything emitted until the outermost scope ends and writes it then
+class scope:
+    def __enter__(self):
+        global depth
+        depth += 1
+
+    def __exit__(self, *exc_info):
+        global depth
+        depth -= 1
+        if depth == 0:
+            flush()
+
+
+# renders a result, a list of results or nothing (None) in the current mode
+def emit(result):
+    global buffered_size
+    if result is None:
+        return
+    if isinstance(result, list):
+        for item in result:
+            emit(item)
+        return
+    if mode == 'quiet' and result.kind != 'error':
+        return
+    if mode == 'json':
+        text = json.dumps({'type': result.kind, **result.data}) + '\n'
+    else:
+        text = ''.join(line + '\n' for line in human(result))
+    buffer.append(text)
+    buffered_size += len(text)
+    if depth == 0 or buffered_size > flush_threshold:
+        flush()
+
+
+# writes the buffer with a single write
+def flush():
+    global buffered_size
+    if buffer:
+        sys.stdout.write(''.join(buffer))
+        sys.stdout.flush()
+        buffer.clear()
+        buffered_size = 0
+
+
+# helper function that takes days as input and converts them into weeks / months
+def time_unit_conversion(days):
+    if days < 0:
+        return "Input must be a non-negative number of days."
+
+    weeks, remaining_days = divmod(days, 7)
+
+    if weeks > 0 and remaining_days > 0:
+        return f"{weeks} week{'s' if weeks > 1 else ''} and {remaining_days} day{'s' if remaining_days > 1 else ''}"
+    elif weeks > 0:
+        return f"{weeks} week{'s' if weeks > 1 else ''}"
+    elif days > 0:
+        return f"{days} day{'s' if days > 1 else ''}"
+    else:
+        return "0 days"
+
+
+# returns the lines of the streak report of a habit
+def analysis_lines(data):
+    lines = ['Here is the analysis for your ' + data['habit'] + ' Habit',
+             '-------------------------------------',
+             'This Habit has ' + str(len(data['streaks'])) + ' Streaks',
+             '-------------------------------------']
+    for number, streak in enumerate(data['streaks'], 1):
+        lines.append('--- Streak Number: ' + str(number) + ' ---')
+        lines.append('Streak Start: ' + streak['start'])
+        lines.append('Streak Duration: ' + time_unit_conversion(streak['days']) + ' (' + str(streak['periods']) +
+                     ' Periods)')
+        # print Ongoing instead of date in the future
+        lines.append('Streak End: ' + ('Ongoing' if streak['ongoing'] else streak['end']))
+    return lines
+
+
+# returns a numbered line per streak of a leaderboard
+def streak_lines(streaks, empty):
+    if not streaks:
+        return [empty]
+    return [str(number) + '. ' + streak['habit'] + ': ' + time_unit_conversion(streak['days']) + ' (' +
+            str(streak['periods']) + ' Period(s)) from ' + streak['start'] + ' to ' +
+            ('Ongoing' if streak['ongoing'] else streak['end']) for number, streak in enumerate(streaks, 1)]
+
+
+def loaded_lines(data):
+    lines = ['Loading Save Data from file...',
+             'Loaded ' + str(data['habits']) + ' Habits in ' + str(data['ms']) + ' ms (' + str(data['complete']) +
+             ' loaded completely)']
+    # version 1 and 2 save files are written again in the current format while they are loaded
+    if data['converted_from'] is not None:
+        lines.append(war + 'Converted save file from version ' + str(data['converted_from']) + ' to the new format')
+    return lines
+
+
+# result kind -> function returning the lines of the human readable form
+human_forms = {
+    'error': lambda data: [err + ' ' + data['message']],
+    'invalidCommand': lambda data: ['Invalid Command'],
+    'habitAdded': lambda data: ['Added Habit: ' + data['name']],
+    'habitRemoved': lambda data: ['Deleted Habit ' + data['name']],
+    'taskAdded': lambda data: ['Added task ' + data['task'] + ' to Habit ' + data['habit']],
+    'taskRemoved': lambda data: ['Task ' + data['task'] + ' in Habit ' + data['habit'] + ' has been removed'],
+    'taskChecked': lambda data: ['Checked Task'],
+    'habits': lambda data: [str(data['habits'])],
+    'tasks': lambda data: [str(data['tasks'])],
+    'habitsByPeriod': lambda data: ['Habits with Period ' + str(entry['period']) + ': ' + str(entry['habits'])
+                                    for entry in data['periods']],
+    'habitsWithTask': lambda data: ['Habits with Task ' + data['task'] + ': ' + str(data['habits'])],
+    'completions': lambda data: [Time.format_timestamp(entry['time']) + ' ' + entry['habit'] + ': ' + entry['task']
+                                 for entry in data['completions']] or ['There are no completions on these days'],
+    'analysis': analysis_lines,
+    'maxStreakAll': lambda data: ['The Longest Streak was your ' + data['habit'] + ' Habit',
+                                  'It lasted for ' + time_unit_conversion(data['days']) + ' (' +
+                                  str(round(data['days'] / data['period'], 2)) + ' Period(s))',
+                                  'Beginning on ' + data['start'] + ' and Ending on ' + data['end']],
+    'maxStreak': lambda data: ['The Longest Streak in your ' + data['habit'] + ' Habit lasted for ' +
+                               time_unit_conversion(data['days']) + ' (' +
+                               str(round(data['days'] / data['period'], 2)) + ' Period(s))',
+                               'Beginning on ' + data['start'] + ' and Ending on ' + data['end']],
+    'noStreaks': lambda data: ['There are no streaks yet'],
+    'leaderboard': lambda data: streak_lines(data['streaks'], 'There are no streaks yet'),
+    'currentStreaks': lambda data: streak_lines(data['streaks'], 'There are no current streaks'),
+    'saved': lambda data: ['Saved!'],
+    'compacted': lambda data: ['Compacted save file'],
+    'loaded': loaded_lines,
+    'noSaveFile': lambda data: [war + 'No Save File found!'],
+    'habitImported': lambda data: ['Imported Habit: ' + data['name']],
+    'habitSkipped': lambda data: [war + 'Skipped Habit ' + data['name'] + ' - a Habit with that name already exists'],
+    'exported': lambda data: ['Exported ' + str(data['habits']) + ' Habits to ' + data['file']],
+    'completionsSkipped': lambda data: [war + 'Skipped ' + str(data['count']) + ' completions of unknown Task ' +
+                                        data['task'] + ' in Habit ' + data['habit']],
+    'completionsImported': lambda data: ['Imported ' + str(data['imported']) + ' completions (' +
+                                         str(data['skipped']) + ' skipped) in ' + str(data['seconds']) + ' s (' +
+                                         str(data['events_per_second']) + ' events/s)'],
+    'scriptRun': lambda data: ['Ran ' + str(data['commands']) + ' commands in ' + str(data['seconds']) + ' s (' +
+                               str(data['commands_per_second']) + ' commands/s)'],
+    'changesMerged': lambda data: ['Merged ' + str(data['completions']) + ' completions from another process'],
+    'saveFileReloaded': lambda data: [war + 'The save file has been changed by another process - reloading'],
+    'statsEnabled': lambda data: ['Statistics enabled'],
+    'statsDisabled': lambda data: ['Statistics disabled'],
+    'statsCleared': lambda data: ['Statistics cleared'],
+    'stats': lambda data: ([] if data['enabled'] else [war + 'Statistics are disabled - turn them on with stats on']) +
+                          ['Save file loaded in ' + str(data['load_ms']) + ' ms'] +
+                          Stats.report(data['commands'], data['counters']),
+    'profile': lambda data: [data['text']],
+}
+
+
+# returns the lines of the human readable form of a result
+def human(result):
+    return human_forms[result.kind](result.data)
@@ -0,0 +1,374 @@
+import asyncio
+import contextlib
+import json
+from datetime import datetime
+from http import HTTPStatus
+from urllib.parse import parse_qs, unquote, urlsplit
+import TrackerAnalytics as Analytics
+import TrackerBatch as Batch
+import TrackerExceptions as Exceptions
+import TrackerOutput as Output
+import TrackerStorage as Storage
+import TrackerStreak as Streak
+from TrackerHabit import Habit
+from TrackerTime import format_timestamp
+
+# http/json api server - many clients share the habits and the store of one tracker process
+# all changes are made on the event loop thread and written as the same change records the command line uses
+# every habit has its own lock, so check-ins on different habits do not wait for each other, while streak analyses
+# run in the default executor with the lock of their habit held
+# records arriving while the previous ones are being written to disk are written together with a single fsync
+# and a request is only answered once its change is on disk
+# after every write the changes other processes made to the save file are merged (see tracker.sync_changes)
+# all file access happens in the executor - while changes of other processes are merged or the journal is folded into
+# a new snapshot, requests that change or analyse habits wait at a gate instead of blocking the event loop
+#
+# GET    /habits                              names of all habits
+# POST   /habits                              {"name": ..., "period": ...}
+# DELETE /habits/<habit>
+# GET    /habits/<habit>/tasks                names of the tasks of a habit
+# POST   /habits/<habit>/tasks                {"task": ...}
+# DELETE /habits/<habit>/tasks/<task>
+# POST   /habits/<habit>/tasks/<task>/check   optional {"time": epoch seconds or Y-m-d H:M:S}
+# GET    /habits/<habit>/analysis             all streaks of a habit
+# GET    /streaks/max                         longest streak over all habits (null if there is none)
+# GET    /streaks/top?k=&period=&from=&to=    k longest streaks (default 10), optionally of habits with a period or
+#                                             overlapping a time range (epoch seconds or Y-m-d H:M:S)
+# GET    /streaks/current?k=&period=          streaks that can still be continued, longest first
+
+
+class Server:
+    def __init__(self, habits, store):
+        self.habits = habits
+        self.store = store
+        # habit name -> asyncio.Lock
+        self.locks = {}
+        # executor futures of the analyses that are running
+        self.analyses = set()
+        # records applied in memory but not written yet and the future that is resolved once they are on disk
+        self.pending = []
+        self.flushed = None
+        self.writer = None
+        # future that is resolved once the running maintenance of the store is done (None if there is none)
+        self.maintenance = None
+
+    def lock(self, name):
+        return self.locks.setdefault(name, asyncio.Lock())
+
+    # waits until the store is not being maintained - nothing may be awaited between this and the change it guards
+    async def writable(self):
+        while self.maintenance is not None:
+            await asyncio.shield(self.maintenance)
+
+    # returns a habit or raises ElementNotFound
+    def get_habit(self, name):
+        if name not in self.habits:
+            raise Exceptions.ElementNotFound('There is no habit with that name!')
+        return self.habits[name]
+
+    # applies a change record to the habits and queues it for the store
+    # returns the future to wait for before the change can be reported (None without a store)
+    def change(self, record):
+        Storage.apply_record(self.habits, record)
+        if self.store is None:
+            return None
+        loop = asyncio.get_running_loop()
+        self.pending.append(record)
+        if self.flushed is None:
+            self.flushed = loop.create_future()
+        if self.writer is None or self.writer.done():
+            self.writer = loop.create_task(self.write_pending())
+        return self.flushed
+
+    # writes the queued records in the executor until there are none left - one write and fsync per round
+    async def write_pending(self):
+        loop = asyncio.get_running_loop()
+        while self.pending:
+            if not await self.write_now():
+                continue
+            changes = await loop.run_in_executor(None, self.store.changes)
+            if changes != []:
+                await self.maintain(self.merge, changes)
+            if self.store.needs_compaction():
+                await self.compact()
+
+    # waits until no analysis is running
+    async def idle(self):
+        while self.analyses:
+            await asyncio.wait(list(self.analyses))
+
+    # writes the records that were applied since the last write in the executor - returns False if that failed
+    async def write_now(self):
+        records, self.pending = self.pending, []
+        flushed, self.flushed = self.flushed, None
+        try:
+            if records:
+                await asyncio.get_running_loop().run_in_executor(None, self.store.write_many, records)
+        except Exception as e:
+            if flushed is not None:
+                flushed.set_exception(e)
+            return False
+        if flushed is not None:
+            flushed.set_result(len(records))
+        return True
+
+    # closes the gate, waits for the running analyses and writes the records that were applied before, then runs
+    # function in the executor - it returns the habits that were loaded again or None, which are taken over here
+    async def maintain(self, function, *args):
+        loop = asyncio.get_running_loop()
+        self.maintenance = loop.create_future()
+        try:
+            await self.idle()
+            if not await self.write_now():
+                return
+            habits = await loop.run_in_executor(None, function, *args)
+            if habits is not None:
+                self.habits.clear()
+                self.habits.update(habits)
+        except Exception as e:
+            Output.emit(Output.error('Could not update the save file: ' + str(e)))
+        finally:
+            self.maintenance.set_result(None)
+            self.maintenance = None
+
+    # merges the records of other processes into the habits - None or records that do not just add completions
+    # load the habits again, which are returned then (runs in the executor while the gate is closed)
+    def merge(self, changes):
+        if changes is not None and all(record['op'] in Storage.merged_operations for record in changes):
+            for record in changes:
+                Storage.replay_record(self.habits, record)
+            return None
+        habits = {}
+        self.store.reload(habits)
+        return habits
+
+    # merges the changes of other processes and folds the journal into a new snapshot - the save file stays locked
+    # throughout, so no other process can write in between (runs in the executor while the gate is closed)
+    def compact_store(self):
+        with self.store.locked():
+            habits = self.merge(self.store.changes())
+            self.store.compact(self.habits if habits is None else habits)
+        return habits
+
+    # folds the journal into a new snapshot
+    async def compact(self):
+        await self.maintain(self.compact_store)
+
+    # runs a cpu heavy function in the executor
+    async def analyse(self, function, *args):
+        await self.writable()
+        future = asyncio.get_running_loop().run_in_executor(None, function, *args)
+        self.analyses.add(future)
+        future.add_done_callback(self.analyses.discard)
+        return await future
+
+    async def add_habit(self, data):
+        name = data['name']
+        await self.writable()
+        if name in self.habits:
+            raise Exceptions.ElementAlreadyExists('A Habit with that name already exists!')
+        # the habit is created once to validate the input, the record is what creates it in memory and on disk
+        habit = Habit(name, data['period'])
+        flushed = self.change({'op': 'addHabit', 'name': name, 'period': habit.period,
+                               'creation_date': habit.creation_date})
+        if flushed is not None:
+            await flushed
+        return {'name': name, 'period': habit.period, 'creation_date': habit.creation_date}
+
+    async def remove_habit(self, name):
+        habit = self.get_habit(name)
+        async with self.lock(name):
+            await self.writable()
+            if self.habits.get(name) is not habit:
+                raise Exceptions.ElementNotFound('There is no habit with that name!')
+            flushed = self.change({'op': 'removeHabit', 'name': name})
+            del self.locks[name]
+        if flushed is not None:
+            await flushed
+        return {'name': name}
+
+    async def add_task(self, name, data):
+        task = data['task']
+        if not isinstance(task, str):
+            raise TypeError("The Task's name must be a string!")
+        habit = self.get_habit(name)
+        async with self.lock(name):
+            await self.writable()
+            if self.habits.get(name) is not habit:
+                raise Exceptions.ElementNotFound('There is no habit with that name!')
+            if task in habit.tasks:
+                raise Exceptions.ElementAlreadyExists('This Task already exists!')
+            flushed = self.change({'op': 'addTask', 'habit': name, 'task': task})
+        if flushed is not None:
+            await flushed
+        return {'habit': name, 'task': task}
+
+    async def remove_task(self, name, task):
+        habit = self.get_habit(name)
+        async with self.lock(name):
+            await self.writable()
+            if self.habits.get(name) is not habit:
+                raise Exceptions.ElementNotFound('There is no habit with that name!')
+            if task not in habit.tasks:
+                raise Exceptions.ElementNotFound('There is no task with that name!')
+            flushed = self.change({'op': 'removeTask', 'habit': name, 'task': task})
+        if flushed is not None:
+            await flushed
+        return {'habit': name, 'task': task}
+
+    async def check_task(self, name, task, data):
+        stamp = Batch.to_stamp(data['time']) if 'time' in data else Streak.to_seconds(datetime.now())
+        habit = self.get_habit(name)
+        async with self.lock(name):
+            await self.writable()
+            if self.habits.get(name) is not habit:
+                raise Exceptions.ElementNotFound('There is no habit with that name!')
+            if task not in habit.tasks:
+                raise Exceptions.ElementNotFound('There is no task with that name!')
+            flushed = self.change({'op': 'checkTask', 'habit': name, 'task': task, 'time': stamp})
+        if flushed is not None:
+            await flushed
+        return {'habit': name, 'task': task, 'time': format_timestamp(stamp)}
+
+    async def get_analysis(self, name):
+        habit = self.get_habit(name)
+        async with self.lock(name):
+            streaks = await self.analyse(habit.calculate_streak)
+        return {'habit': name, 'period': habit.period,
+                'streaks': [Output.streak_data(habit, streak) for streak in streaks]}
+
+    async def get_max_streak_all(self):
+        habits, top_streak = await self.query(Analytics.longest_streak)
+        if top_streak is None:
+            return None
+        habit = habits[top_streak[0]]
+        return dict(Output.streak_data(habit, habit.to_streaks([top_streak[1:]])[0]), habit=habit.name)
+
+    async def get_top_streaks(self, query):
+        k = int(query.get('k', 10))
+        period = int(query['period']) if 'period' in query else None
+        since = Batch.to_stamp(query['from']) if 'from' in query else None
+        until = Batch.to_stamp(query['to']) if 'to' in query else None
+        habits, entries = await self.query(Analytics.top_streaks, k, None, period, since, until)
+        return [dict(Output.streak_data(habits[name], habits[name].to_streaks([run])[0]), habit=name)
+                for name, run in entries]
+
+    async def get_current_streaks(self, query):
+        k = int(query['k']) if 'k' in query else None
+        period = int(query['period']) if 'period' in query else None
+        habits, entries = await self.query(Analytics.current_streaks, k, None, period)
+        return [dict(Output.streak_data(habits[name], habits[name].to_streaks([run])[0]), habit=name)
+                for name, run in entries]
+
+    # runs a query over all habits with the lock of every habit held - returns the habits it ran on and its result
+    async def query(self, function, *args):
+        habits = dict(self.habits)
+        async with contextlib.AsyncExitStack() as stack:
+            # locks are always taken in name order, so two requests holding several locks cannot deadlock
+            for name in sorted(habits):
+                await stack.enter_async_context(self.lock(name))
+            return habits, await self.analyse(function, habits, *args)
+
+    # maps a request to its handler - returns the status code and the json data of the response
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        parts = [unquote(part) for part in url.path.strip('/').split('/')]
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            data = json.loads(body) if body else {}
+            if not isinstance(data, dict):
+                raise ValueError('The request body must be a json object')
+
+            if parts == ['habits'] and method == 'GET':
+                return 200, list(self.habits)
+            elif parts == ['habits'] and method == 'POST':
+                return 201, await self.add_habit(data)
+            elif parts == ['streaks', 'max'] and method == 'GET':
+                return 200, await self.get_max_streak_all()
+            elif parts == ['streaks', 'top'] and method == 'GET':
+                return 200, await self.get_top_streaks(query)
+            elif parts == ['streaks', 'current'] and method == 'GET':
+                return 200, await self.get_current_streaks(query)
+            elif len(parts) == 2 and parts[0] == 'habits' and method == 'DELETE':
+                return 200, await self.remove_habit(parts[1])
+            elif len(parts) == 3 and parts[0] == 'habits' and parts[2] == 'tasks' and method == 'GET':
+                return 200, list(self.get_habit(parts[1]).tasks)
+            elif len(parts) == 3 and parts[0] == 'habits' and parts[2] == 'tasks' and method == 'POST':
+                return 201, await self.add_task(parts[1], data)
+            elif len(parts) == 3 and parts[0] == 'habits' and parts[2] == 'analysis' and method == 'GET':
+                return 200, await self.get_analysis(parts[1])
+            elif len(parts) == 4 and parts[0] == 'habits' and parts[2] == 'tasks' and method == 'DELETE':
+                return 200, await self.remove_task(parts[1], parts[3])
+            elif len(parts) == 5 and parts[0] == 'habits' and parts[2] == 'tasks' and parts[4] == 'check' \
+                    and method == 'POST':
+                return 201, await self.check_task(parts[1], parts[3], data)
+            return 404, {'error': 'Unknown endpoint: ' + method + ' ' + target}
+        except Exceptions.ElementNotFound as e:
+            return 404, {'error': str(e)}
+        except Exceptions.ElementAlreadyExists as e:
+            return 409, {'error': str(e)}
+        except KeyError as e:
+            return 400, {'error': 'Missing field ' + str(e)}
+        except (Exceptions.HabitTypeError, TypeError, ValueError) as e:
+            return 400, {'error': str(e)}
+        except Exception as e:
+            return 500, {'error': str(e)}
+
+    # reads http/1.1 requests from a connection until the client closes it
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    method, target, version = line.decode('latin-1').split()
+                except ValueError:
+                    await self.respond(writer, 400, {'error': 'Malformed request line'}, False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                body = await reader.readexactly(length) if length else b''
+
+                status, data = await self.dispatch(method, target, body)
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                await self.respond(writer, status, data, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def respond(writer, status, data, keep_alive):
+        payload = json.dumps(data).encode()
+        head = 'HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n{}\r\n'.format(
+            status, HTTPStatus(status).phrase, len(payload), '' if keep_alive else 'Connection: close\r\n')
+        writer.write(head.encode('latin-1') + payload)
+        await writer.drain()
+
+    # starts listening - port 0 picks a free port, the asyncio server is returned
+    async def listen(self, host, port):
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    async def run(self, host, port):
+        listener = await self.listen(host, port)
+        host, port = listener.sockets[0].getsockname()[:2]
+        print('Serving the Habit Tracker API on http://' + host + ':' + str(port) + ' (Ctrl+C to stop)', flush=True)
+        async with listener:
+            await listener.serve_forever()
+
+
+# serves the habits until the process is interrupted
+def serve(habits, store, host='127.0.0.1', port=8080):
+    try:
+        asyncio.run(Server(habits, store).run(host, port))
+    except KeyboardInterrupt:
+        print('Server stopped')
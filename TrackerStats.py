@@ -0,0 +1,105 @@
+import cProfile
+import io
+import math
+import pstats
+import random
+
+# instrumentation - command latencies and counters for the expensive parts of the tracker
+# disabled by default, every update is guarded by `if Stats.enabled` at the call site so a disabled tracker only
+# pays for reading one module attribute
+
+enabled = False
+
+# counter name -> value
+counters = {}
+
+# command name -> Latencies
+latencies = {}
+
+# latencies kept per command
+reservoir_size = 1024
+
+
+# latencies of a command - count and maximum are exact, the samples the percentiles are taken from are at most
+# reservoir_size latencies chosen uniformly from all of them (reservoir sampling), so a long session does not keep
+# every latency it has measured
+class Latencies:
+    __slots__ = ('count', 'maximum', 'samples')
+
+    def __init__(self):
+        self.count = 0
+        self.maximum = 0
+        self.samples = []
+
+    def add(self, seconds):
+        self.count += 1
+        self.maximum = max(self.maximum, seconds)
+        if len(self.samples) < reservoir_size:
+            self.samples.append(seconds)
+        else:
+            index = random.randrange(self.count)
+            if index < reservoir_size:
+                self.samples[index] = seconds
+
+
+# adds amount to a counter
+def count(name, amount=1):
+    counters[name] = counters.get(name, 0) + amount
+
+
+# stores the latency of a command
+def record_latency(command, seconds):
+    if command not in latencies:
+        latencies[command] = Latencies()
+    latencies[command].add(seconds)
+
+
+# clears all collected numbers
+def reset():
+    counters.clear()
+    latencies.clear()
+
+
+# returns the value below which the given fraction of the samples lie (nearest rank)
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+# returns the latencies of every command as {command: {count, p50_ms, p95_ms, max_ms}}
+def summary():
+    return {command: {'count': values.count, 'p50_ms': round(percentile(values.samples, 0.5) * 1000, 3),
+                      'p95_ms': round(percentile(values.samples, 0.95) * 1000, 3),
+                      'max_ms': round(values.maximum * 1000, 3)}
+            for command, values in sorted(latencies.items())}
+
+
+# returns the collected numbers (or a summary and counters given) as printable lines
+def report(commands=None, values=None):
+    if commands is None:
+        commands = summary()
+    if values is None:
+        values = counters
+    lines = ['{:20} {:>7} {:>10} {:>10} {:>10}'.format('Command', 'Count', 'p50 (ms)', 'p95 (ms)', 'max (ms)')]
+    for command, numbers in commands.items():
+        lines.append('{:20} {:>7} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+            command, numbers['count'], numbers['p50_ms'], numbers['p95_ms'], numbers['max_ms']))
+    lines.append('')
+    for name in sorted(values):
+        lines.append('{:30} {:>12}'.format(name, values[name]))
+    return lines
+
+
+# runs a function under cProfile and returns its result and the pstats.Stats of the run
+def profile(function):
+    profiler = cProfile.Profile()
+    result = profiler.runcall(function)
+    return result, pstats.Stats(profiler)
+
+
+# returns the top functions of a profile by cumulative time as text
+def profile_text(stats, top=15):
+    output = io.StringIO()
+    stats.stream = output
+    stats.sort_stats('cumulative').print_stats(top)
+    return output.getvalue()
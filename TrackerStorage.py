@@ -0,0 +1,887 @@
+import base64
+import contextlib
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from array import array
+import TrackerExceptions as Exceptions
+import TrackerStats as Stats
+import TrackerStreak as Streak
+from TrackerHabit import Habit, to_completions
+
+try:
+    import fcntl
+except ImportError:
+    # no advisory locks on windows - only one process may use a save file there
+    fcntl = None
+
+# persistence layer - every store loads all habits into the habits dict and receives each change as a record
+# ({'op': 'checkTask', 'habit': ..., 'task': ..., 'time': ...}), the same records that make up the json journal
+# JournalStore: json snapshot of all habits plus an append-only journal of every change made since
+# BinaryStore: like JournalStore, but the snapshot is a binary file that is memory mapped on load
+# SqliteStore: habits, tasks and completions tables that are updated row by row
+# all stores only read habit headers on startup, the completions of a habit are loaded the first time it is used
+# several processes may share a save file: the file stores take an advisory lock (<save file>.lock) around every
+# load, write and compaction and pick up the records other processes appended to the journal (see changes())
+
+# current version of the snapshot format
+# version 1 files are a plain list of habits with timestamp strings, version 2 stores epoch seconds
+# version 3 starts with a header line listing every habit and the byte range of its completions, followed by
+# one line of completions per habit
+# version 4 adds a line with the day bitmaps of the habit's tasks after each line of completions, so streaks can be
+# computed without reading the completions - the bitmap line carries a checksum of the completions line and is
+# ignored if the completions have been edited by hand
+snapshot_version = 4
+
+# journal size in bytes above which the journal is folded into a new snapshot
+compact_threshold = 1024 * 1024
+
+# change records that only add completions - they give the same result in any order, so the records of another
+# process can be merged into the habits in memory instead of loading the save file again
+merged_operations = {'checkTask', 'importCompletions'}
+
+# binary snapshot - a fixed header (magic, version, directory length), the habit directory as json and the data
+# blocks: the completions of every task as contiguous int64 values followed by its two day bitmaps
+# every block starts at a multiple of 8 bytes, offsets in the directory are relative to the first block
+# integers are stored in the byte order of the machine (little endian on all supported platforms)
+binary_magic = b'HBTRACKB'
+binary_version = 1
+binary_header = struct.Struct('<8sIIQ')
+
+
+# converts a habit into a snapshot entry - also used as the body of addHabit records for imported habits
+def habit_entry(habit):
+    return {'name': habit.name, 'period': habit.period, 'creation_date': habit.creation_date,
+            'tasks': {task: habit.completions(task).tolist() for task in habit.tasks}}
+
+
+# writes all habits in the current snapshot format
+def write_snapshot(f, habits, sequence=0):
+    headers = []
+    bodies = []
+    offset = 0
+    for habit in habits.values():
+        entry = habit_entry(habit)
+        body = (json.dumps({'name': habit.name, 'tasks': entry.pop('tasks')}, separators=(',', ':')) + '\n').encode()
+        bitmaps = bitmap_line(habit, body)
+        headers.append(dict(entry, tasks=list(habit.tasks), offset=offset, length=len(body),
+                            bitmap_length=len(bitmaps)))
+        bodies.append(body)
+        bodies.append(bitmaps)
+        offset += len(body) + len(bitmaps)
+
+    header = {'version': snapshot_version, 'journal': sequence, 'habits': headers}
+    f.write((json.dumps(header, separators=(',', ':')) + '\n').encode())
+    f.writelines(bodies)
+
+
+# encodes the day bitmaps of a habit as the line that follows its completions in the snapshot
+def bitmap_line(habit, body):
+    bitmaps = {task: [base64.b64encode(bitmap.days).decode(), base64.b64encode(bitmap.starts).decode()]
+               for task, bitmap in habit.day_bitmaps().items()}
+    data = {'name': habit.name, 'creation_date': habit.creation_date, 'crc': zlib.crc32(body), 'bitmaps': bitmaps}
+    return (json.dumps(data, separators=(',', ':')) + '\n').encode()
+
+
+# creates a habit from a snapshot entry or an addHabit journal record
+def habit_from_entry(entry):
+    habit = Habit(entry['name'], entry['period'])
+    habit.creation_date = entry['creation_date']
+    habit.tasks = entry.get('tasks', {})
+    return habit
+
+
+# applies a single journal record to the habits dict
+def apply_record(habits, record):
+    operation = record['op']
+    if operation == 'addHabit':
+        habits[record['name']] = habit_from_entry(record)
+    elif operation == 'removeHabit':
+        del habits[record['name']]
+    elif operation == 'addTask':
+        # a task that exists already keeps its completions
+        if record['task'] not in habits[record['habit']].tasks:
+            habits[record['habit']].tasks[record['task']] = []
+    elif operation == 'removeTask':
+        del habits[record['habit']].tasks[record['task']]
+    elif operation == 'checkTask':
+        habits[record['habit']].add_completion(record['task'], record['time'])
+    elif operation == 'importCompletions':
+        habits[record['habit']].add_completions(record['task'], record['times'])
+    else:
+        raise Exceptions.SaveFileError('Unknown journal record: ' + operation)
+
+
+# applies a journal record that may no longer fit the habits - returns False if it was skipped
+# with several processes sharing a save file, one of them can check a task another one has just removed
+def replay_record(habits, record):
+    try:
+        apply_record(habits, record)
+    except (KeyError, Exceptions.ElementNotFound):
+        return False
+    return True
+
+
+# identifies the current contents of a file - changes whenever the file is replaced or written to
+def file_identity(path):
+    try:
+        info = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return info.st_ino, info.st_mtime_ns, info.st_size
+
+
+# buffering of change records shared by the stores - without autosave every record is written at once, with
+# autosave a background thread writes the buffered records once no change has been made for the autosave delay
+class BufferedStore:
+    # records are written after this many delays at the latest, even if changes keep coming
+    max_delays = 10
+
+    def __init__(self):
+        # serializes the writes of the autosave thread with those of the thread using the store
+        self.mutex = threading.RLock()
+        self.condition = threading.Condition()
+        self.buffer = []
+        self.first_change = 0
+        self.last_change = 0
+        self.delay = 0
+        self.thread = None
+        self.stopping = False
+        # exception of the last failed autosave - the records stay buffered and are written again later
+        self.error = None
+
+    def start_autosave(self, delay):
+        self.delay = delay
+        self.stopping = False
+        self.thread = threading.Thread(target=self.autosave, name='autosave', daemon=True)
+        self.thread.start()
+
+    # stops the autosave thread and writes what is still buffered
+    def stop_autosave(self):
+        if self.thread is not None:
+            with self.condition:
+                self.stopping = True
+                self.condition.notify()
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+    # writes a single record - buffered while autosave is running
+    def write(self, record):
+        if self.thread is None:
+            self.write_many([record])
+            return
+        with self.condition:
+            now = time.monotonic()
+            if not self.buffer:
+                self.first_change = now
+            self.buffer.append(record)
+            self.last_change = now
+            self.condition.notify()
+
+    # writes the buffered records now
+    def flush(self):
+        with self.mutex:
+            with self.condition:
+                records, self.buffer = self.buffer, []
+            if not records:
+                return
+            try:
+                self.write_many(records)
+            except Exception:
+                with self.condition:
+                    self.buffer[:0] = records
+                raise
+
+    # autosave thread - waits for a change, then until no change has been made for the delay
+    def autosave(self):
+        while True:
+            with self.condition:
+                while not self.buffer and not self.stopping:
+                    self.condition.wait()
+                while not self.stopping:
+                    remaining = min(self.last_change + self.delay,
+                                    self.first_change + self.max_delays * self.delay) - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                if self.stopping:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                self.error = e
+                with self.condition:
+                    self.first_change = self.last_change = time.monotonic()
+
+
+# keeps the snapshot open so lazily loaded habits can read their completions later
+class SnapshotReader:
+    def __init__(self, f):
+        self.file = f
+        self.lock = threading.Lock()
+
+    def read(self, offset, length):
+        if Stats.enabled:
+            Stats.count('bytes read', length)
+        with self.lock:
+            self.file.seek(offset)
+            return self.file.read(length)
+
+    def close(self):
+        self.file.close()
+
+
+# memory mapped binary snapshot - the completions of loaded habits are views of the mapping
+class MappedSnapshot:
+    def __init__(self, f):
+        self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mapping)
+
+    # returns a read-only view of a block
+    def block(self, offset, length):
+        return self.view[offset:offset + length]
+
+    # closes the mapping - if completions of some habits still point into it, it is closed once they are gone
+    def close(self):
+        try:
+            self.view.release()
+            self.mapping.close()
+        except BufferError:
+            pass
+
+
+# reads the completions and day bitmaps of one habit from a binary snapshot without copying them
+class BinaryLoader:
+    def __init__(self, snapshot, base, entry):
+        self.snapshot = snapshot
+        self.base = base
+        self.entry = entry
+
+    def completions(self):
+        if Stats.enabled:
+            Stats.count('bytes mapped', sum(count * 8 for offset, count in self.entry['tasks'].values()))
+        return {task: self.snapshot.block(self.base + offset, count * 8).cast('q')
+                for task, (offset, count) in self.entry['tasks'].items()}
+
+    def streak_state(self, start, period, tasks):
+        return None
+
+    def bitmaps(self, creation_date):
+        if self.entry['creation_date'] != creation_date:
+            return None
+        return {task: Streak.DayBitmap(self.snapshot.block(self.base + days, days_length),
+                                       self.snapshot.block(self.base + starts, starts_length))
+                for task, (days, days_length, starts, starts_length) in self.entry['bitmaps'].items()}
+
+
+# reads the completions of one habit from its line in a version 3 snapshot and its day bitmaps from the line
+# after it in a version 4 snapshot
+class SnapshotLoader:
+    def __init__(self, reader, name, offset, length, bitmap_length=0):
+        self.reader = reader
+        self.name = name
+        self.offset = offset
+        self.length = length
+        self.bitmap_length = bitmap_length
+
+    def completions(self):
+        data = json.loads(self.reader.read(self.offset, self.length))
+        if data['name'] != self.name:
+            raise Exceptions.SaveFileError('The save file has been changed while it was open!')
+        return {task: to_completions(stamps) for task, stamps in data['tasks'].items()}
+
+    # the snapshot has no precomputed streak data - the habit builds it from the day bitmaps
+    def streak_state(self, start, period, tasks):
+        return None
+
+    # returns the day bitmaps of all tasks - None if the snapshot has none or they do not match the completions
+    def bitmaps(self, creation_date):
+        if not self.bitmap_length:
+            return None
+        data = self.reader.read(self.offset, self.length + self.bitmap_length)
+        try:
+            line = json.loads(data[self.length:])
+        except ValueError:
+            return None
+        if line.get('name') != self.name or line.get('creation_date') != creation_date or \
+                line.get('crc') != zlib.crc32(data[:self.length]):
+            return None
+        return {task: Streak.DayBitmap(base64.b64decode(days), base64.b64decode(starts))
+                for task, (days, starts) in line['bitmaps'].items()}
+
+
+# json snapshot file with a journal next to it (hbtracker_save.json -> hbtracker_save.journal)
+class JournalStore(BufferedStore):
+    # snapshot version written by this store
+    version = snapshot_version
+
+    # a read only store (used to import other save files) takes no lock and leaves the files untouched
+    def __init__(self, path, journal_path=None, read_only=False):
+        super().__init__()
+        self.path = path
+        self.journal_path = journal_path or os.path.splitext(path)[0] + '.journal'
+        self.read_only = read_only
+        self.sequence = 0
+        self.journal_size = 0
+        self.journal = None
+        self.reader = None
+        self.lock_file = None
+        self.lock_depth = 0
+        # the snapshot and journal as this process has seen them - anything beyond was written by another process
+        self.snapshot_identity = file_identity(path)
+        if os.path.exists(self.journal_path):
+            self.journal_size = os.path.getsize(self.journal_path)
+        # records of other processes that have been read but not handed out by changes() yet, and whether another
+        # process has written a new snapshot
+        self.unmerged = []
+        self.replaced = False
+
+    # returns True if there is anything to load
+    def exists(self):
+        return os.path.exists(self.path) or os.path.exists(self.journal_path)
+
+    # holds the advisory lock of the save file - the lock may be taken again while it is held
+    @contextlib.contextmanager
+    def locked(self):
+        with self.mutex:
+            if self.lock_depth == 0 and fcntl is not None and not self.read_only:
+                if self.lock_file is None:
+                    self.lock_file = open(self.path + '.lock', 'a')
+                try:
+                    fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    if Stats.enabled:
+                        Stats.count('lock waits')
+                    fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+            self.lock_depth += 1
+            try:
+                yield
+            finally:
+                self.lock_depth -= 1
+                if self.lock_depth == 0 and fcntl is not None and not self.read_only:
+                    fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    # reads the snapshot and replays the journal into the habits dict
+    # returns the version of the snapshot that was read (None if there is no snapshot)
+    def load(self, habits):
+        with self.locked():
+            self.sequence = 0
+            self.journal_size = 0
+            self.unmerged = []
+            self.replaced = False
+            self.snapshot_identity = file_identity(self.path)
+            version = None
+            if self.snapshot_identity is not None:
+                version = self.load_snapshot(habits)
+            for record in self.read_journal():
+                replay_record(habits, record)
+            return version
+
+    # closes the files of the habits and loads them again
+    def reload(self, habits):
+        self.close_files()
+        return self.load(habits)
+
+    # reads the complete records that have been appended to the journal since it was last read
+    def read_journal(self):
+        records = []
+        if not os.path.exists(self.journal_path):
+            return records
+        start = self.journal_size
+        with open(self.journal_path, 'rb') as f:
+            f.seek(start)
+            for line in f:
+                # an incomplete last line is a record that was being written during a crash - records are only
+                # written under the lock, so no other process can be writing it right now
+                if not line.endswith(b'\n'):
+                    break
+                self.journal_size += len(line)
+                record = json.loads(line)
+                if record['seq'] > self.sequence:
+                    records.append(record)
+                    self.sequence = record['seq']
+        if Stats.enabled:
+            Stats.count('bytes read', self.journal_size - start)
+        # cut off the incomplete record so new records start on a fresh line
+        if not self.read_only and os.path.getsize(self.journal_path) > self.journal_size:
+            os.truncate(self.journal_path, self.journal_size)
+        return records
+
+    # returns the sequence number of the last journal record contained in the snapshot
+    def read_sequence(self):
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, 'rb') as f:
+            header = json.loads(f.readline())
+        return header.get('journal', 0) if isinstance(header, dict) else 0
+
+    # looks for changes other processes made to the save file since this process last read or wrote it
+    # appended records are kept for changes(), a new snapshot means the habits have to be loaded again
+    # has to be called with the lock held
+    def catch_up(self):
+        identity = file_identity(self.path)
+        journal_size = os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+        if identity != self.snapshot_identity or journal_size < self.journal_size:
+            # the snapshot contains every record up to its sequence number and the journal starts over after it
+            self.snapshot_identity = identity
+            self.replaced = True
+            self.unmerged = []
+            self.sequence = self.read_sequence()
+            self.journal_size = 0
+            self.read_journal()
+        elif journal_size != self.journal_size:
+            self.unmerged.extend(self.read_journal())
+
+    # returns the records other processes have written since the last call
+    # None if another process has written a new snapshot - the habits have to be reloaded then
+    def changes(self):
+        with self.locked():
+            self.catch_up()
+            records, self.unmerged = self.unmerged, []
+            if self.replaced:
+                self.replaced = False
+                return None
+            return records
+
+    # reads the snapshot - version 3 files only have their header line parsed, older versions are read completely
+    def load_snapshot(self, habits):
+        f = open(self.path, 'rb')
+        try:
+            header = json.loads(f.readline())
+        except ValueError:
+            header = None
+        if Stats.enabled:
+            Stats.count('bytes read', f.tell())
+        # version 1 and 2 save files are read completely and written again in the current format right away
+        if not isinstance(header, dict) or header['version'] < 3:
+            # a file written on a single line has been parsed completely already
+            data = header
+            if header is None or f.read(1):
+                f.seek(0)
+                data = json.load(f)
+                if Stats.enabled:
+                    Stats.count('bytes read', f.tell())
+            f.close()
+            if isinstance(data, list):
+                data = {'version': 1, 'habits': data}
+            converted = {}
+            for entry in data['habits']:
+                converted[entry['name']] = habit_from_entry(entry)
+            self.sequence = data.get('journal', 0)
+            # the journal is kept - the new snapshot has the same sequence number, so the same records are replayed
+            if not self.read_only:
+                self.replace_snapshot(converted)
+            habits.update(converted)
+            return data['version']
+
+        if header['version'] > snapshot_version:
+            f.close()
+            raise Exceptions.SaveFileError('The save file was written by a newer version of the Habit Tracker!')
+
+        body_start = f.tell()
+        ranges = [(body_start + entry['offset'], entry['length'], entry.get('bitmap_length', 0))
+                  for entry in header['habits']]
+        # the byte ranges are only valid if the file has not been edited by hand - otherwise find the lines again
+        if body_start + sum(length + bitmap_length for offset, length, bitmap_length in ranges) != \
+                os.fstat(f.fileno()).st_size:
+            lines = []
+            for line in f:
+                lines.append((body_start, len(line)))
+                body_start += len(line)
+            if len(lines) == len(header['habits']):
+                ranges = [(offset, length, 0) for offset, length in lines]
+            elif header['version'] >= 4 and len(lines) == 2 * len(header['habits']):
+                ranges = [(offset, length, bitmap[1]) for (offset, length), bitmap in zip(lines[::2], lines[1::2])]
+            else:
+                f.close()
+                raise Exceptions.SaveFileError('The save file is damaged!')
+
+        self.reader = SnapshotReader(f)
+        for entry, (offset, length, bitmap_length) in zip(header['habits'], ranges):
+            habit = Habit(entry['name'], entry['period'])
+            habit.creation_date = entry['creation_date']
+            habit.defer_tasks(entry['tasks'],
+                              SnapshotLoader(self.reader, entry['name'], offset, length, bitmap_length))
+            habits[habit.name] = habit
+        self.sequence = header['journal']
+        return header['version']
+
+    # appends several records with a single write and fsync
+    # records other processes appended before are read first, so the sequence numbers go on after theirs
+    def write_many(self, records):
+        if self.read_only:
+            raise Exceptions.SaveFileError('The save file has been opened read only!')
+        with self.locked():
+            self.catch_up()
+            if self.journal is None:
+                self.journal = open(self.journal_path, 'ab')
+            lines = []
+            for record in records:
+                self.sequence += 1
+                lines.append(json.dumps(dict(record, seq=self.sequence), separators=(',', ':')) + '\n')
+            data = ''.join(lines).encode()
+            self.journal.write(data)
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+            self.journal_size += len(data)
+        if Stats.enabled:
+            Stats.count('bytes written', len(data))
+
+    # returns True once the journal has grown large enough to be folded into the snapshot
+    def needs_compaction(self):
+        return self.journal_size > compact_threshold
+
+    # writes a new snapshot atomically (temp file + rename) and empties the journal
+    # writing the snapshot loads every habit, so the old snapshot can be closed before it is replaced
+    def compact(self, habits):
+        if self.read_only:
+            raise Exceptions.SaveFileError('The save file has been opened read only!')
+        with self.locked():
+            # buffered records are part of the snapshot - they are written first, so they cannot end up in the
+            # journal after it
+            self.flush()
+            self.catch_up()
+            if self.replaced or self.unmerged:
+                raise Exceptions.SaveFileError('The save file has been changed by another process - '
+                                               'merge the changes before compacting')
+            self.replace_snapshot(habits)
+
+            # records up to self.sequence are part of the snapshot now - a crash before truncating only leaves
+            # records behind that are skipped on the next load
+            self.close_files()
+            with open(self.journal_path, 'wb') as f:
+                os.fsync(f.fileno())
+            self.journal_size = 0
+
+    # writes a new snapshot to a temp file and renames it over the old one - has to be called with the lock held
+    def replace_snapshot(self, habits):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            self.write_snapshot(f, habits)
+            f.flush()
+            os.fsync(f.fileno())
+            if Stats.enabled:
+                Stats.count('bytes written', f.tell())
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        os.replace(temp_path, self.path)
+        self.snapshot_identity = file_identity(self.path)
+
+    def write_snapshot(self, f, habits):
+        write_snapshot(f, habits, self.sequence)
+
+    def close_files(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+    # stops the autosave thread, writes the buffered records and closes all files
+    def close(self):
+        self.stop_autosave()
+        self.close_files()
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+
+# binary snapshot file with a json journal next to it (hbtracker_save.bin -> hbtracker_save.bin.journal)
+# the snapshot is memory mapped on load - completions are read straight from the mapping and only copied into
+# memory when a task is changed
+class BinaryStore(JournalStore):
+    version = binary_version
+
+    def __init__(self, path):
+        super().__init__(path, path + '.journal')
+
+    # reads the header and the habit directory - returns the version, the directory and where the blocks start
+    @staticmethod
+    def read_directory(f):
+        header = f.read(binary_header.size)
+        if len(header) < binary_header.size or header[:8] != binary_magic:
+            raise Exceptions.SaveFileError('The save file is not a binary snapshot!')
+        magic, version, flags, length = binary_header.unpack(header)
+        if version > binary_version:
+            raise Exceptions.SaveFileError('The save file was written by a newer version of the Habit Tracker!')
+        try:
+            directory = json.loads(f.read(length))
+        except ValueError:
+            raise Exceptions.SaveFileError('The save file is damaged!')
+        if Stats.enabled:
+            Stats.count('bytes read', binary_header.size + length)
+        return version, directory, binary_header.size + padded(length)
+
+    def load_snapshot(self, habits):
+        with open(self.path, 'rb') as f:
+            version, directory, base = self.read_directory(f)
+            self.reader = MappedSnapshot(f)
+
+        for entry in directory['habits']:
+            habit = Habit(entry['name'], entry['period'])
+            habit.creation_date = entry['creation_date']
+            habit.defer_tasks(list(entry['tasks']), BinaryLoader(self.reader, base, entry))
+            habits[habit.name] = habit
+        self.sequence = directory['journal']
+        return version
+
+    def read_sequence(self):
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, 'rb') as f:
+            return self.read_directory(f)[1]['journal']
+
+    # the habits read their completions from the mapped file - they are copied before the file is replaced
+    def compact(self, habits):
+        for habit in habits.values():
+            habit.tasks.detach()
+        super().compact(habits)
+
+    def write_snapshot(self, f, habits):
+        entries = []
+        blocks = []
+        offset = 0
+        for habit in habits.values():
+            bitmaps = habit.day_bitmaps()
+            tasks = {}
+            bitmap_blocks = {}
+            for task in habit.tasks:
+                block = bytes(habit.completions(task))
+                tasks[task] = [offset, len(block) // 8]
+                offset += append_block(blocks, block)
+                days = offset
+                offset += append_block(blocks, bytes(bitmaps[task].days))
+                starts = offset
+                offset += append_block(blocks, bytes(bitmaps[task].starts))
+                bitmap_blocks[task] = [days, len(bitmaps[task].days), starts, len(bitmaps[task].starts)]
+            entries.append({'name': habit.name, 'period': habit.period, 'creation_date': habit.creation_date,
+                            'tasks': tasks, 'bitmaps': bitmap_blocks})
+
+        directory = json.dumps({'journal': self.sequence, 'habits': entries}, separators=(',', ':')).encode()
+        f.write(binary_header.pack(binary_magic, binary_version, 0, len(directory)))
+        f.write(directory + bytes(padded(len(directory)) - len(directory)))
+        f.writelines(blocks)
+
+
+# returns a length rounded up to a multiple of 8
+def padded(length):
+    return (length + 7) & ~7
+
+
+# adds a data block padded to a multiple of 8 bytes to the list of blocks - returns the padded length
+def append_block(blocks, block):
+    blocks.append(block + bytes(padded(len(block)) - len(block)))
+    return len(blocks[-1])
+
+
+# sqlite database with one row per habit, task and completion
+# sqlite locks the database itself - changes of other processes are noticed through the data version of the database
+class SqliteStore(BufferedStore):
+    # the database has no snapshot version
+    version = None
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS habits (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            period INTEGER NOT NULL,
+            creation_date TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY,
+            habit INTEGER NOT NULL REFERENCES habits (id) ON DELETE CASCADE,
+            name TEXT NOT NULL,
+            UNIQUE (habit, name)
+        );
+        CREATE TABLE IF NOT EXISTS completions (
+            task INTEGER NOT NULL REFERENCES tasks (id) ON DELETE CASCADE,
+            time INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS completions_by_task ON completions (task, time);
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.connection = None
+        self.data_version = None
+
+    # opens the database and creates the tables on first use
+    # the connection may be used by the writer thread of the api server, sqlite serializes the calls itself
+    def connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute('PRAGMA foreign_keys = ON')
+            if 'habit' in [row[1] for row in self.connection.execute('PRAGMA table_info(completions)')]:
+                self.drop_completion_habits()
+            self.connection.executescript(self.schema)
+            self.data_version = self.connection.execute('PRAGMA data_version').fetchone()[0]
+        return self.connection
+
+    # databases of earlier versions also stored the habit of every completion - the table is copied without it
+    def drop_completion_habits(self):
+        with self.connection:
+            self.connection.execute('CREATE TABLE completions_new (task INTEGER NOT NULL REFERENCES tasks (id) '
+                                    'ON DELETE CASCADE, time INTEGER NOT NULL)')
+            self.connection.execute('INSERT INTO completions_new (task, time) SELECT task, time FROM completions')
+            self.connection.execute('DROP TABLE completions')
+            self.connection.execute('ALTER TABLE completions_new RENAME TO completions')
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    # reads the habits and their task names into the habits dict - completions are read when a habit is first used
+    # the database has no snapshot version, so None is returned
+    def load(self, habits):
+        connection = self.connect()
+        tasks = {}
+        for habit_id, task in connection.execute('SELECT habit, name FROM tasks ORDER BY id'):
+            tasks.setdefault(habit_id, []).append(task)
+        for habit_id, name, period, creation_date in connection.execute(
+                'SELECT id, name, period, creation_date FROM habits ORDER BY id'):
+            habit = Habit(name, period)
+            habit.creation_date = creation_date
+            habit.defer_tasks(tasks.get(habit_id, []), SqliteLoader(self, habit_id))
+            habits[name] = habit
+        return None
+
+    def reload(self, habits):
+        return self.load(habits)
+
+    # the database does its own locking - only the threads of this process are serialized
+    @contextlib.contextmanager
+    def locked(self):
+        with self.mutex:
+            yield
+
+    # the data version changes whenever another connection commits - the habits are loaded again then (None),
+    # single records of other processes cannot be told apart in the tables
+    def changes(self):
+        with self.mutex:
+            data_version = self.connect().execute('PRAGMA data_version').fetchone()[0]
+            if data_version == self.data_version:
+                return []
+            self.data_version = data_version
+            return None
+
+    # applies several change records in one transaction
+    def write_many(self, records):
+        with self.mutex, self.connect():
+            for record in records:
+                self.apply(record)
+
+    # applies a change record to the tables
+    def apply(self, record):
+        connection = self.connection
+        operation = record['op']
+        if operation == 'addHabit':
+            self.insert_habit(record)
+        elif operation == 'removeHabit':
+            connection.execute('DELETE FROM habits WHERE name = ?', (record['name'],))
+        elif operation == 'addTask':
+            connection.execute('INSERT INTO tasks (habit, name) SELECT id, ? FROM habits WHERE name = ?',
+                               (record['task'], record['habit']))
+        elif operation == 'removeTask':
+            connection.execute('DELETE FROM tasks WHERE name = ? AND habit = (SELECT id FROM habits WHERE name = ?)',
+                               (record['task'], record['habit']))
+        elif operation == 'checkTask':
+            connection.execute('INSERT INTO completions (task, time) SELECT tasks.id, ? '
+                               'FROM tasks JOIN habits ON habits.id = tasks.habit '
+                               'WHERE habits.name = ? AND tasks.name = ?',
+                               (record['time'], record['habit'], record['task']))
+        elif operation == 'importCompletions':
+            task, = connection.execute('SELECT tasks.id FROM tasks JOIN habits ON habits.id = tasks.habit '
+                                       'WHERE habits.name = ? AND tasks.name = ?',
+                                       (record['habit'], record['task'])).fetchone()
+            connection.executemany('INSERT INTO completions (task, time) VALUES (?, ?)',
+                                   ((task, time) for time in record['times']))
+        else:
+            raise Exceptions.SaveFileError('Unknown change record: ' + operation)
+
+    # inserts a habit together with the tasks and completions of an addHabit record
+    def insert_habit(self, entry):
+        cursor = self.connection.execute('INSERT INTO habits (name, period, creation_date) VALUES (?, ?, ?)',
+                                         (entry['name'], entry['period'], entry['creation_date']))
+        habit_id = cursor.lastrowid
+        for task, stamps in entry.get('tasks', {}).items():
+            task_id = self.connection.execute('INSERT INTO tasks (habit, name) VALUES (?, ?)',
+                                              (habit_id, task)).lastrowid
+            self.connection.executemany('INSERT INTO completions (task, time) VALUES (?, ?)',
+                                        ((task_id, stamp) for stamp in stamps))
+
+    # rows are written as changes happen - there is never a journal to fold
+    def needs_compaction(self):
+        return False
+
+    # every change is committed when it is written, so there is nothing to fold - the records that are still
+    # buffered are written, the changes of other processes have already been merged by then
+    def compact(self, habits):
+        self.flush()
+
+    # builds a streak summary with a grouped query - one row per task and period instead of one row per
+    # completion, a completion exactly on a boundary (offset 0) also counts for the previous period
+    def period_state(self, habit_id, start, period, tasks):
+        connection = self.connect()
+        state = Streak.StreakState(start, period)
+        for task in tasks:
+            state.add_task(task)
+        for task, index, offset in connection.execute(
+                'SELECT tasks.name, (completions.time - :start) / :period AS idx, '
+                'MIN((completions.time - :start) % :period) '
+                'FROM completions JOIN tasks ON tasks.id = completions.task '
+                'WHERE tasks.habit = :habit AND completions.time >= :start '
+                'GROUP BY completions.task, idx',
+                {'start': state.start, 'period': state.period, 'habit': habit_id}):
+            state.add_period(task, index)
+            if offset == 0 and index > 0:
+                state.add_period(task, index - 1)
+        return state
+
+    # returns the completion arrays of all tasks of a habit
+    def completions(self, habit_id):
+        connection = self.connect()
+        data = {task: array('q') for task, in connection.execute(
+            'SELECT name FROM tasks WHERE habit = ? ORDER BY id', (habit_id,))}
+        for task, time in connection.execute(
+                'SELECT tasks.name, completions.time FROM completions JOIN tasks ON tasks.id = completions.task '
+                'WHERE tasks.habit = ? ORDER BY completions.task, completions.time', (habit_id,)):
+            data[task].append(time)
+        return data
+
+    def close(self):
+        self.stop_autosave()
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+# reads the completions or the streak summary of one habit from the database
+class SqliteLoader:
+    def __init__(self, store, habit_id):
+        self.store = store
+        self.habit_id = habit_id
+
+    def completions(self):
+        return self.store.completions(self.habit_id)
+
+    def streak_state(self, start, period, tasks):
+        return self.store.period_state(self.habit_id, start, period, tasks)
+
+    # the database computes streaks with a grouped query instead of storing day bitmaps
+    def bitmaps(self, creation_date):
+        return None
+
+
+# storage backends that can be selected on startup
+backends = {'json': JournalStore, 'binary': BinaryStore, 'sqlite': SqliteStore}
+
+# save file used by each backend if none is given
+default_files = {'json': 'hbtracker_save.json', 'binary': 'hbtracker_save.bin', 'sqlite': 'hbtracker_save.db'}
@@ -0,0 +1,192 @@
+from datetime import datetime, timedelta
+
+# streak engine - assigns every completion to its period with integer arithmetic instead of
+# scanning all completions for every period
+# all times are whole seconds since the epoch, periods are closed intervals
+# [start + k * period, start + (k + 1) * period]
+# sets of periods are kept as bitsets (python ints, bit k stands for period k), so finding the periods in which all
+# tasks are done is an AND over the tasks and finding streaks is a scan for runs of set bits
+
+# reference point for converting the naive datetimes used by the tracker into seconds
+EPOCH = datetime(1970, 1, 1)
+
+
+# converts a naive datetime into whole seconds since the epoch (rounded down)
+def to_seconds(dt):
+    return (dt - EPOCH) // timedelta(seconds=1)
+
+
+# converts seconds since the epoch back into a naive datetime
+def from_seconds(seconds):
+    return EPOCH + timedelta(seconds=seconds)
+
+
+# returns the number of periods that have started between start and now
+def period_count(start, period, now):
+    if now < start:
+        return 0
+    return (now - start) // period + 1
+
+
+# sets a bit in a bitmap that grows as needed
+def set_bit(bitmap, index):
+    position = index >> 3
+    if position >= len(bitmap):
+        bitmap.extend(bytes(position - len(bitmap) + 1))
+    bitmap[position] |= 1 << (index & 7)
+
+
+# returns a bitset in which bit i is set if any of the bits i to i + width - 1 of bits is set
+# the window is built from power of two windows, so it takes O(log width) operations on the whole bitset
+def window(bits, width):
+    result = 0
+    offset = 0
+    size = 1
+    while width:
+        if width & 1:
+            result |= bits >> offset
+            offset += size
+        width >>= 1
+        if width:
+            bits |= bits >> size
+            size <<= 1
+    return result
+
+
+# returns the [first, last] runs of consecutive set bits
+def bitset_runs(bits):
+    text = format(bits, 'b')[::-1]
+    data = []
+    end = 0
+    while True:
+        first = text.find('1', end)
+        if first < 0:
+            return data
+        end = text.find('0', first)
+        if end < 0:
+            end = len(text)
+        data.append([first, end - 1])
+
+
+# per-task completion bitmap - bit d of days is set if the task was done on day d after the creation date and bit d
+# of starts if it was done exactly at the start of day d, the moment that also ends the previous period
+class DayBitmap:
+    __slots__ = ('days', 'starts')
+
+    def __init__(self, days=b'', starts=b''):
+        self.days = bytearray(days)
+        self.starts = bytearray(starts)
+
+    # records a completion given in seconds after the creation date
+    def add(self, offset):
+        if offset < 0:
+            return
+        day, rest = divmod(offset, 86400)
+        set_bit(self.days, day)
+        if rest == 0:
+            set_bit(self.starts, day)
+
+    # returns the bitset of periods (of the given number of days) the task has been done in
+    # a period covers days [k * days, (k + 1) * days) plus the first moment of the next period
+    def periods(self, days):
+        done = window(int.from_bytes(self.days, 'little'), days) | (int.from_bytes(self.starts, 'little') >> days)
+        if days == 1:
+            return done
+        # keep every days-th bit - the bit of the first day of each period
+        text = format(done, 'b')[::-1][::days]
+        return int(text[::-1], 2) if text else 0
+
+
+# builds the day bitmap of a task from its completions
+def day_bitmap(stamps, start):
+    bitmap = DayBitmap()
+    for stamp in stamps:
+        bitmap.add(stamp - start)
+    return bitmap
+
+
+# persistent streak summary of a habit - one bitset of completed periods per task, updated with every completion
+# instead of replaying the whole history, the periods in which all tasks are done are the AND of these bitsets
+class StreakState:
+    def __init__(self, start, period):
+        self.start = start
+        self.period = period
+        # task name -> bitset of the period indices the task has been completed in
+        self.tasks = {}
+        # bitset of the periods in which every task has been completed - None until it is needed again
+        self.covered = None
+        # (period count, runs, runs from longest to shortest) - None until it is needed again
+        self.ranking = None
+
+    # returns the period indices a single completion counts for
+    def periods_of(self, stamp):
+        offset = stamp - self.start
+        if offset < 0:
+            return ()
+        index, rest = divmod(offset, self.period)
+        if rest == 0 and index > 0:
+            return index - 1, index
+        return index,
+
+    # registers a new task - no period is complete until the new task has been done in it as well
+    def add_task(self, name):
+        self.set_periods(name, 0)
+
+    def remove_task(self, name):
+        del self.tasks[name]
+        self.covered = None
+        self.ranking = None
+
+    # replaces all completions of a task
+    def set_task(self, name, stamps):
+        bitmap = bytearray()
+        for stamp in stamps:
+            for index in self.periods_of(stamp):
+                set_bit(bitmap, index)
+        self.set_periods(name, int.from_bytes(bitmap, 'little'))
+
+    # replaces the bitset of completed periods of a task - used with the periods of a DayBitmap
+    def set_periods(self, name, bits):
+        self.tasks[name] = bits
+        self.covered = None
+        self.ranking = None
+
+    # records a single completion of a task
+    def add_completion(self, name, stamp):
+        for index in self.periods_of(stamp):
+            self.add_period(name, index)
+
+    # marks a task as done in a period - used directly when the periods come from a grouped database query
+    def add_period(self, name, index):
+        bit = 1 << index
+        if not self.tasks[name] & bit:
+            self.tasks[name] |= bit
+            if self.covered is not None and all(bits & bit for bits in self.tasks.values()):
+                self.covered |= bit
+                self.ranking = None
+
+    # returns the bitset of periods in which every task has been completed
+    def common_periods(self):
+        if self.covered is None:
+            covered = None
+            for bits in self.tasks.values():
+                covered = bits if covered is None else covered & bits
+            self.covered = covered or 0
+        return self.covered
+
+    # returns the runs of complete periods that have started by now
+    def streaks(self, now):
+        count = period_count(self.start, self.period, now)
+        # a habit without tasks is complete in every period
+        if not self.tasks:
+            return [[0, count - 1]] if count else []
+        return bitset_runs(self.common_periods() & ((1 << count) - 1))
+
+    # returns the period count by now, the runs and the runs ordered from longest to shortest (the earlier run first
+    # on a tie) - kept until a task changes or another period starts
+    def ranked(self, now):
+        count = period_count(self.start, self.period, now)
+        if self.ranking is None or self.ranking[0] != count:
+            runs = self.streaks(now)
+            self.ranking = (count, runs, sorted(runs, key=lambda run: run[0] - run[1]))
+        return self.ranking
@@ -0,0 +1,68 @@
+from datetime import date, datetime
+from functools import lru_cache
+import TrackerStats as Stats
+import TrackerStreak as Streak
+
+# timestamp parsing and formatting - stored timestamps always have the fixed 'Y-m-d H:M:S' layout, which is read with
+# datetime.fromisoformat (about ten times faster than strptime) and converted into epoch seconds with integer
+# arithmetic, values in any other layout fall back to strptime
+# parsed and formatted values are kept in small LRU caches, creation dates and the timestamps of a habit that is shown
+# or imported again are then converted only once
+
+FORMAT = '%Y-%m-%d %H:%M:%S'
+DATE_FORMAT = '%Y-%m-%d'
+
+# day number of the epoch as returned by date.toordinal
+EPOCH_DAY = Streak.EPOCH.toordinal()
+
+# entries kept per cache
+cache_size = 4096
+
+
+# converts a stored timestamp string into seconds since the epoch
+def parse_timestamp(value):
+    if Stats.enabled:
+        Stats.count('timestamps parsed')
+    return cached_parse(value)
+
+
+@lru_cache(maxsize=cache_size)
+def cached_parse(value):
+    if len(value) == 19 and value[4] == '-' and value[7] == '-' and value[10] == ' ' and value[13] == ':' and \
+            value[16] == ':':
+        dt = datetime.fromisoformat(value)
+    else:
+        dt = datetime.strptime(value, FORMAT)
+    return (dt.toordinal() - EPOCH_DAY) * 86400 + dt.hour * 3600 + dt.minute * 60 + dt.second
+
+
+# converts a Y-m-d date into days since the epoch
+def parse_date(value):
+    if len(value) == 10 and value[4] == '-' and value[7] == '-':
+        return date.fromisoformat(value).toordinal() - EPOCH_DAY
+    return datetime.strptime(value, DATE_FORMAT).toordinal() - EPOCH_DAY
+
+
+# converts seconds since the epoch back into the timestamp string shown to the user
+@lru_cache(maxsize=cache_size)
+def format_timestamp(seconds):
+    return format_datetime(Streak.from_seconds(seconds))
+
+
+# formats a naive datetime with whole seconds
+def format_datetime(dt):
+    return dt.isoformat(' ')
+
+
+# returns the start of period index of a habit that started at start (epoch seconds) - streak reports ask for the same
+# boundaries of a habit again and again
+@lru_cache(maxsize=cache_size)
+def period_boundary(start, period, index):
+    return Streak.from_seconds(start + period * 86400 * index)
+
+
+# drops all cached values
+def clear_caches():
+    cached_parse.cache_clear()
+    format_timestamp.cache_clear()
+    period_boundary.cache_clear()
@@ -0,0 +1,44 @@
+import random
+from array import array
+from datetime import datetime
+import TrackerStreak as Streak
+from TrackerHabit import Habit
+
+# deterministic synthetic habits for benchmarks and tests - the same arguments always give the same data
+
+# periods are drawn from this list, so daily and weekly habits are the most common
+periods = [1, 1, 1, 2, 3, 7, 7, 14, 30]
+
+# all generated completions lie before this date
+end_date = datetime(2026, 1, 1)
+
+
+# generates count habits with tasks tasks each and years of completions
+# habits switch between streaks and breaks, during a streak a task is still forgotten now and then and during a
+# break it is done occasionally
+def generate_habits(count, tasks, years, seed=0):
+    rng = random.Random(seed)
+    end = Streak.to_seconds(end_date)
+    habits = {}
+    for number in range(count):
+        period = rng.choice(periods)
+        length = period * 86400
+        start = end - int(years * 365 * 86400) + rng.randrange(86400)
+
+        completions = {'task_' + str(task): array('q') for task in range(tasks)}
+        active = rng.random() < 0.7
+        for index in range((end - start) // length + 1):
+            if rng.random() < (0.1 if active else 0.4):
+                active = not active
+            for stamps in completions.values():
+                if rng.random() < (0.95 if active else 0.2):
+                    for _ in range(rng.choice((1, 1, 1, 2))):
+                        stamp = start + index * length + rng.randrange(length)
+                        if stamp <= end:
+                            stamps.append(stamp)
+
+        habit = Habit('habit_' + str(number), period)
+        habit.creation_seconds = start
+        habit.tasks = completions
+        habits[habit.name] = habit
+    return habits
@@ -0,0 +1,141 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import quote
+import TrackerStats as Stats
+import TrackerStorage as Storage
+from bench_data import generate_habits
+
+# load generator for the api server - run with `python bench_server.py`
+# without --port a server is started in a separate process on generated habits, otherwise the server that is already
+# running on --host/--port is used
+# every client keeps one connection open and sends its requests one after the other, mostly check-ins on random
+# habits with some analyses mixed in - the result is printed as one json line
+
+
+# sends one request over an open connection and returns the status code and the decoded body
+async def request(reader, writer, method, path, data=None):
+    payload = json.dumps(data).encode() if data is not None else b''
+    writer.write('{} {} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n'
+                 .format(method, quote(path), len(payload)).encode() + payload)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode().partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+# one client - sends count requests and stores their latencies
+async def client(host, port, targets, count, args, rng, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    for _ in range(count):
+        habit, tasks = rng.choice(targets)
+        roll = rng.random()
+        if roll < args.max:
+            method, path = 'GET', '/streaks/max'
+        elif roll < args.max + args.analysis:
+            method, path = 'GET', '/habits/' + habit + '/analysis'
+        else:
+            method, path = 'POST', '/habits/' + habit + '/tasks/' + rng.choice(tasks) + '/check'
+        start = time.perf_counter()
+        status, _ = await request(reader, writer, method, path, {} if method == 'POST' else None)
+        latencies.append(time.perf_counter() - start)
+        if status >= 400:
+            errors.append(status)
+    writer.close()
+
+
+# runs the clients against a server and returns the result
+async def run_load(host, port, args):
+    reader, writer = await asyncio.open_connection(host, port)
+    targets = []
+    for habit in (await request(reader, writer, 'GET', '/habits'))[1]:
+        tasks = (await request(reader, writer, 'GET', '/habits/' + habit + '/tasks'))[1]
+        if tasks:
+            targets.append((habit, tasks))
+    writer.close()
+    if not targets:
+        raise SystemExit('The server has no habits with tasks to check in')
+
+    latencies = []
+    errors = []
+    rng = random.Random(args.seed)
+    share, rest = divmod(args.requests, args.clients)
+    start = time.perf_counter()
+    await asyncio.gather(*(client(host, port, targets, share + (number < rest), args, random.Random(rng.random()),
+                                  latencies, errors)
+                           for number in range(args.clients)))
+    seconds = time.perf_counter() - start
+    return {'clients': args.clients, 'requests': len(latencies), 'errors': len(errors),
+            'seconds': round(seconds, 6), 'requests_per_second': round(len(latencies) / seconds),
+            'p50_ms': round(Stats.percentile(latencies, 0.5) * 1000, 3),
+            'p95_ms': round(Stats.percentile(latencies, 0.95) * 1000, 3),
+            'p99_ms': round(Stats.percentile(latencies, 0.99) * 1000, 3),
+            'max_ms': round(max(latencies) * 1000, 3)}
+
+
+# writes generated habits to a save file and starts a server process on it - returns the process and its port
+def start_server(directory, args):
+    save_file = os.path.join(directory, 'bench.db' if args.storage == 'sqlite' else 'bench.json')
+    store = Storage.backends[args.storage](save_file)
+    store.compact(generate_habits(args.habits, args.tasks, args.years))
+    store.close()
+    process = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tracker.py'),
+                                '--storage', args.storage, '--file', save_file, '--serve', '--port', '0'],
+                               stdout=subprocess.PIPE, text=True)
+    for line in process.stdout:
+        if line.startswith('Serving'):
+            url = next(word for word in line.split() if word.startswith('http://'))
+            return process, int(url.rsplit(':', 1)[1])
+    raise SystemExit('The server did not start')
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench_server.py', description='Habit Tracker api server load generator')
+    parser.add_argument('--host', default='127.0.0.1', help='address of the server')
+    parser.add_argument('--port', type=int, help='port of a running server (default: start one on generated habits)')
+    parser.add_argument('--storage', choices=sorted(Storage.backends), default='json',
+                        help='storage backend of the started server (default: json)')
+    parser.add_argument('--habits', type=int, default=200, help='generated habits (default: 200)')
+    parser.add_argument('--tasks', type=int, default=5, help='tasks per generated habit (default: 5)')
+    parser.add_argument('--years', type=float, default=1, help='years of generated completions (default: 1)')
+    parser.add_argument('--clients', type=int, default=50, help='concurrent clients (default: 50)')
+    parser.add_argument('--requests', type=int, default=5000, help='requests over all clients (default: 5000)')
+    parser.add_argument('--analysis', type=float, default=0.05, help='share of habit analyses (default: 0.05)')
+    parser.add_argument('--max', type=float, default=0.005, help='share of max streak queries (default: 0.005)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='file the json result is appended to')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        process = None
+        port = args.port
+        if port is None:
+            process, port = start_server(directory, args)
+        try:
+            result = asyncio.run(run_load(args.host, port, args))
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+    print(json.dumps(result))
+    if args.output:
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+import tracker
+import TrackerStorage as Storage
+import TrackerStreak as Streak
+import TrackerTime as Time
+from datetime import datetime
+from bench_data import generate_habits
+
+# benchmark suite for the tracker hot paths - run with `python bench_tracker.py`
+# every result is printed as one json line, --output appends them to a file so runs before and after a change can be
+# kept next to each other and compared with --compare
+
+# size tiers - number of habits, tasks per habit and years of completions
+tiers = {
+    'small': (10, 3, 1),
+    'medium': (100, 5, 3),
+    'large': (1000, 8, 5),
+}
+
+
+# runs a function with all output suppressed
+def quiet(function):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function()
+
+
+# times a function - best of repeat runs, the peak memory is taken from one extra run under tracemalloc
+# setup is called before every run and is not timed
+def measure(function, repeat, setup=None):
+    best = None
+    for _ in range(repeat):
+        if setup:
+            quiet(setup)
+        start = time.perf_counter()
+        quiet(function)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    if setup:
+        quiet(setup)
+    tracemalloc.start()
+    quiet(function)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+# drops the cached streak summaries and day bitmaps so calculate_streak has to build them again
+def clear_streaks():
+    for habit in tracker.habits.values():
+        habit._streaks = None
+        habit._bitmaps = None
+
+
+# runs all benchmarks of one tier and returns the results
+def run_tier(name, repeat, directory, storage='json'):
+    count, tasks, years = tiers[name]
+    tracker.habits.clear()
+    tracker.habits.update(generate_habits(count, tasks, years))
+    tracker.index.rebuild(tracker.habits)
+    tracker.backend = storage
+    tracker.save_file = os.path.join(directory, name + os.path.splitext(Storage.default_files[storage])[1])
+    tracker.store = None
+    completions = sum(len(habit.completions(task)) for habit in tracker.habits.values() for task in habit.tasks)
+
+    def calculate_all():
+        for habit in tracker.habits.values():
+            habit.calculate_streak()
+
+    # every completion as a timestamp string - parsed with strptime (the old path), parsed with an empty cache and
+    # formatted again, the repeated parse reads as many timestamps as the cache holds a second time
+    stamps = [stamp for habit in tracker.habits.values() for task in habit.tasks for stamp in habit.completions(task)]
+    strings = [Time.format_timestamp(stamp) for stamp in stamps]
+    repeated = strings[:Time.cache_size]
+
+    def parse_strptime():
+        for value in strings:
+            Streak.to_seconds(datetime.strptime(value, Time.FORMAT))
+
+    def parse_all():
+        for value in strings:
+            Time.parse_timestamp(value)
+
+    def parse_repeated():
+        for value in repeated:
+            Time.parse_timestamp(value)
+
+    def format_all():
+        for stamp in stamps:
+            Time.format_timestamp(stamp)
+
+    def load_all():
+        tracker.reload()
+        for habit in tracker.habits.values():
+            habit.tasks.hydrate()
+
+    benchmarks = [
+        ('parse_timestamps_strptime', parse_strptime, None),
+        ('parse_timestamps', parse_all, Time.clear_caches),
+        ('parse_timestamps_repeated', parse_repeated, lambda: Time.clear_caches() or parse_repeated()),
+        ('format_timestamps', format_all, Time.clear_caches),
+        ('calculate_streak', calculate_all, clear_streaks),
+        ('calculate_streak_cached', calculate_all, None),
+        ('get_max_streak_all_cached', tracker.get_max_streak_all, None),
+        ('leaderboard_cached', lambda: tracker.leaderboard(10), None),
+        ('get_max_streak_all', tracker.get_max_streak_all, clear_streaks),
+        ('get_habits_by_period', tracker.get_habits_by_period, None),
+        ('save_to_file', tracker.save_to_file, None),
+        ('calculate_streak_saved_bitmaps', calculate_all, tracker.reload),
+        ('load_from_file', tracker.reload, None),
+        ('load_from_file_complete', load_all, None),
+    ]
+
+    results = []
+    for operation, function, setup in benchmarks:
+        seconds, peak = measure(function, repeat, setup)
+        results.append({'tier': name, 'storage': storage, 'operation': operation, 'habits': count,
+                        'completions': completions, 'seconds': round(seconds, 6),
+                        'completions_per_second': round(completions / seconds) if seconds else None,
+                        'peak_memory_bytes': peak})
+        if operation.startswith(('parse_', 'format_')):
+            parsed = len(repeated) if operation == 'parse_timestamps_repeated' else len(stamps)
+            results[-1]['completions_per_second'] = round(parsed / seconds)
+            results[-1]['ns_per_timestamp'] = round(seconds / parsed * 1e9)
+    if tracker.store is not None:
+        tracker.store.close()
+        tracker.store = None
+    return results
+
+
+# prints how much faster or slower every operation is compared to an earlier results file
+def compare(results, path):
+    earlier = {}
+    with open(path) as f:
+        for line in f:
+            entry = json.loads(line)
+            earlier[(entry['tier'], entry.get('storage', 'json'), entry['operation'])] = entry
+    for entry in results:
+        before = earlier.get((entry['tier'], entry['storage'], entry['operation']))
+        if before and entry['seconds']:
+            print('{:8} {:8} {:30} {:>10.4f}s -> {:>10.4f}s  ({:.2f}x)'.format(
+                entry['tier'], entry['storage'], entry['operation'], before['seconds'], entry['seconds'],
+                before['seconds'] / entry['seconds']))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench_tracker.py', description='Habit Tracker benchmarks')
+    parser.add_argument('--tiers', nargs='+', choices=list(tiers), default=['small', 'medium'],
+                        help='size tiers to run (default: small medium)')
+    parser.add_argument('--storage', choices=['json', 'binary'], default='json',
+                        help='save file format used by the save and load benchmarks (default: json)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark, the best one is reported')
+    parser.add_argument('--output', help='file the json results are appended to')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name in args.tiers:
+            for entry in run_tier(name, args.repeat, directory, args.storage):
+                print(json.dumps(entry))
+                results.append(entry)
+
+    if args.output:
+        with open(args.output, 'a') as f:
+            for entry in results:
+                f.write(json.dumps(entry) + '\n')
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,42 @@
+import asyncio
+import http.client
+import json
+import os
+import shutil
+import threading
+import tracemalloc
+import pytest
 import tracker
+import TrackerAnalytics as Analytics
+import TrackerIndex as Index
+import TrackerOutput as Output
+import TrackerServer as Server
+import TrackerStats as Stats
+import TrackerStorage as Storage
+import TrackerStreak as Streak
+import TrackerTime as Time
+from bench_data import generate_habits
 from datetime import datetime, timedelta
+from TrackerHabit import Habit
+
+
+# copy of the example save file - importing it must not touch the file in the repository
+@pytest.fixture
+def sample_file(tmp_path):
+    path = tmp_path / 'sample.json'
+    shutil.copy(os.path.join(os.path.dirname(__file__), 'hbtracker_save.json'), path)
+    return str(path)
+
+
+# empty tracker with a json save file in tmp_path - the store that is open at the end of the test is closed
+@pytest.fixture
+def fresh_tracker(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracker, 'save_file', str(tmp_path / 'hbtracker_save.json'))
+    monkeypatch.setattr(tracker, 'store', None)
+    monkeypatch.setattr(tracker, 'habits', {})
+    monkeypatch.setattr(tracker, 'index', Index.HabitIndex())
+    yield
+    tracker.close_store()
 
 
 # adds a habit and checks that it is correctly stored in the habit array
@@ -82,3 +119,701 @@ def test_calcualate_streak():
     target = [[datetime(2023, 8, 1, 1, 40, 31), 8, datetime(2023, 9, 26, 1, 40, 31)],
               [datetime(2023, 10, 3, 1, 40, 31), 2, datetime(2023, 10, 17, 1, 40, 31)]]
     assert tracker.habits['examplehabit'].calculate_streak() == target
+
+
+# checks streaks for unsorted timestamps, completions before the creation date and completions on a period boundary
+def test_calculate_streak_boundaries():
+    tracker.add_habit('boundaryhabit', 2)
+    tracker.add_task('boundaryhabit', 'task1')
+    tracker.add_task('boundaryhabit', 'task2')
+    tracker.habits['boundaryhabit'].creation_date = "2023-01-01 00:00:00"
+    tracker.habits['boundaryhabit'].tasks['task1'] = ["2023-01-03 00:00:00",
+                                                      "2023-01-06 10:00:00",
+                                                      "2022-12-31 10:00:00",
+                                                      "2023-01-09 00:00:00",
+                                                      "2023-01-15 00:00:00"]
+    tracker.habits['boundaryhabit'].tasks['task2'] = ["2023-01-02 12:00:00",
+                                                      "2023-01-05 00:00:00",
+                                                      "2023-01-08 23:59:59",
+                                                      "2023-01-07 00:00:00",
+                                                      "2023-01-09 00:00:00",
+                                                      "2023-01-15 00:00:00"]
+    target = [[datetime(2023, 1, 1), 5, datetime(2023, 1, 11)],
+              [datetime(2023, 1, 13), 2, datetime(2023, 1, 17)]]
+    assert tracker.habits['boundaryhabit'].calculate_streak() == target
+
+
+# checks that the cached streak summary follows check-ins, task changes and the passing of time
+def test_incremental_streak():
+    tracker.add_habit('incrementalhabit', 1)
+    tracker.add_task('incrementalhabit', 'task1')
+    habit = tracker.habits['incrementalhabit']
+    habit.creation_date = (datetime.now() - timedelta(days=3, hours=12)).strftime('%Y-%m-%d %H:%M:%S')
+    habit.tasks['task1'] = [(datetime.now() - timedelta(days=n)).strftime('%Y-%m-%d %H:%M:%S') for n in (3, 2)]
+    assert [streak[1] for streak in habit.calculate_streak()] == [2]
+
+    # checking in extends the ongoing streak without a rebuild
+    habit.check_task('task1')
+    assert [streak[1] for streak in habit.calculate_streak()] == [2, 1]
+
+    # a new task breaks every period until it has been done, removing it restores the streaks
+    tracker.add_task('incrementalhabit', 'task2')
+    assert habit.calculate_streak() == []
+    tracker.check_task('incrementalhabit', 'task2')
+    assert [streak[1] for streak in habit.calculate_streak()] == [1]
+    tracker.remove_task('incrementalhabit', 'task2')
+    assert [streak[1] for streak in habit.calculate_streak()] == [2, 1]
+
+
+# checks that the streak summary only reports periods that have already started
+def test_streak_state_time():
+    state = Streak.StreakState(0, 10)
+    state.add_task('task1')
+    for stamp in (0, 15, 20, 45):
+        state.add_completion('task1', stamp)
+    assert state.streaks(-1) == []
+    assert state.streaks(5) == [[0, 0]]
+    assert state.streaks(25) == [[0, 2]]
+    assert state.streaks(100) == [[0, 2], [4, 4]]
+
+
+# saves habits in the current format and loads a legacy save file with timestamp strings
+def test_save_and_load(fresh_tracker):
+    tracker.add_habit('savehabit', 7)
+    tracker.add_task('savehabit', 'task1')
+    tracker.habits['savehabit'].tasks['task1'] = ["2023-08-07 12:10:25", "2023-08-01 15:40:31"]
+    tracker.save_to_file()
+
+    with open(tracker.save_file) as f:
+        header = json.loads(f.readline())
+        body = json.loads(f.readline())
+    assert header['version'] == Storage.snapshot_version
+    assert header['habits'][0]['tasks'] == ['task1']
+    assert body['tasks']['task1'] == [1690904431, 1691410225]
+
+    tracker.reload()
+    assert list(tracker.habits['savehabit'].tasks['task1']) == ["2023-08-01 15:40:31", "2023-08-07 12:10:25"]
+
+    # version 1 files store a plain list of habits with timestamp strings
+    with open(tracker.save_file, 'w') as f:
+        json.dump([{'name': 'legacyhabit', 'period': 1, 'creation_date': "2023-08-01 12:41:51",
+                    'tasks': {'task1': ["2023-08-08 12:50:55", "2023-08-07 12:10:25"]}}], f)
+    assert tracker.reload()['converted_from'] == 1
+    assert list(tracker.habits) == ['legacyhabit']
+    assert tracker.habits['legacyhabit'].completions('task1').tolist() == [1691410225, 1691499055]
+    # the file has been written in the current format while loading
+    with open(tracker.save_file) as f:
+        assert json.loads(f.readline())['version'] == Storage.snapshot_version
+    assert tracker.reload()['converted_from'] is None
+    assert tracker.habits['legacyhabit'].completions('task1').tolist() == [1691410225, 1691499055]
+
+    # version 2 files store epoch seconds - the journal records after their sequence number are replayed before and
+    # after the conversion
+    tracker.close_store()
+    with open(tracker.save_file, 'w') as f:
+        json.dump({'version': 2, 'journal': 1, 'habits': [{'name': 'legacyhabit', 'period': 1,
+                                                          'creation_date': "2023-08-01 12:41:51",
+                                                          'tasks': {'task1': [1691410225]}}]}, f)
+    with open(os.path.splitext(tracker.save_file)[0] + '.journal', 'w') as f:
+        f.write('{"op":"checkTask","habit":"legacyhabit","task":"task1","time":1691410000,"seq":1}\n'
+                '{"op":"checkTask","habit":"legacyhabit","task":"task1","time":1691499055,"seq":2}\n')
+    for version in [2, None]:
+        assert tracker.reload()['converted_from'] == version
+        assert tracker.habits['legacyhabit'].completions('task1').tolist() == [1691410225, 1691499055]
+
+
+# replays journaled changes on load and folds them into the snapshot on compaction
+def test_journal(tmp_path, fresh_tracker):
+    tracker.load_from_file()
+    tracker.add_habit('journalhabit', 1)
+    tracker.add_task('journalhabit', 'task1')
+    tracker.add_task('journalhabit', 'task2')
+    tracker.remove_task('journalhabit', 'task2')
+    tracker.check_task('journalhabit', 'task1')
+    stamps = tracker.habits['journalhabit'].completions('task1').tolist()
+    assert not (tmp_path / 'hbtracker_save.json').exists()
+
+    # a record that was cut off by a crash is ignored
+    with open(tmp_path / 'hbtracker_save.journal', 'ab') as f:
+        f.write(b'{"op":"removeHabit","name":"journ')
+    tracker.reload()
+    assert list(tracker.habits['journalhabit'].tasks) == ['task1']
+    assert tracker.habits['journalhabit'].completions('task1').tolist() == stamps
+    tracker.add_task('journalhabit', 'task3')
+    tracker.reload()
+    assert list(tracker.habits['journalhabit'].tasks) == ['task1', 'task3']
+
+    tracker.compact()
+    assert (tmp_path / 'hbtracker_save.journal').stat().st_size == 0
+    tracker.check_task('journalhabit', 'task1')
+    tracker.reload()
+    assert len(tracker.habits['journalhabit'].tasks['task1']) == 2
+
+
+# writes changes to a sqlite store, imports a json save file and analyses a habit with a grouped query
+def test_sqlite_store(tmp_path, monkeypatch, sample_file, fresh_tracker):
+    monkeypatch.setattr(tracker, 'backend', 'sqlite')
+    monkeypatch.setattr(tracker, 'save_file', str(tmp_path / 'hbtracker_save.db'))
+    tracker.load_from_file()
+    tracker.add_habit('sqlitehabit', 1)
+    tracker.add_task('sqlitehabit', 'task1')
+    tracker.add_task('sqlitehabit', 'task2')
+    tracker.remove_task('sqlitehabit', 'task2')
+    tracker.check_task('sqlitehabit', 'task1')
+    tracker.import_json(sample_file)
+    tracker.store.close()
+    expected = {name: Storage.habit_entry(habit) for name, habit in tracker.habits.items()}
+    now = Streak.to_seconds(datetime.now())
+    streaks = {name: habit.streak_state().streaks(now) for name, habit in tracker.habits.items()}
+
+    # the streak summaries of habits that have not been read yet come from a grouped query
+    tracker.reload()
+    for name, habit in tracker.habits.items():
+        assert habit.streak_state().streaks(now) == streaks[name]
+        assert not habit.is_loaded()
+    assert {name: Storage.habit_entry(habit) for name, habit in tracker.habits.items()} == expected
+
+    tracker.remove_habit('workout')
+    tracker.reload()
+    assert 'workout' not in tracker.habits
+    assert tracker.store.connect().execute('SELECT COUNT(*) FROM tasks WHERE name = "run_10_miles"').fetchone() == (0,)
+
+    # saving only writes the buffered changes and loads the rows another process has committed - it neither reads
+    # the completions of the habits nor rewrites the database
+    other = Storage.SqliteStore(tracker.save_file)
+    other.write({'op': 'addHabit', 'name': 'otherhabit', 'period': 1, 'creation_date': '2023-08-01 10:00:00'})
+    tracker.store.compact(tracker.habits)
+    assert tracker.save_to_file() == [Output.Result('saveFileReloaded'), Output.Result('saved')]
+    assert 'otherhabit' in tracker.habits
+    assert not any(habit.is_loaded() for habit in tracker.habits.values())
+    other.close()
+
+
+# loads only the habit headers on startup and reads the completions of a habit when it is first used
+def test_lazy_load(sample_file, fresh_tracker):
+    tracker.import_json(sample_file)
+    expected = {name: Storage.habit_entry(habit) for name, habit in tracker.habits.items()}
+    tracker.save_to_file()
+
+    tracker.reload()
+    assert not any(habit.is_loaded() for habit in tracker.habits.values())
+    assert list(tracker.habits['workout'].tasks) == ['run_10_miles', 'stretch']
+    tracker.check_task('reading', 'read_5_pages')
+    assert [name for name, habit in tracker.habits.items() if habit.is_loaded()] == ['reading']
+    expected['reading'] = Storage.habit_entry(tracker.habits['reading'])
+    assert {name: Storage.habit_entry(habit) for name, habit in tracker.habits.items()} == expected
+
+    # a hand edited snapshot no longer matches the byte ranges in its header
+    with open(tracker.save_file) as f:
+        lines = f.readlines()
+    with open(tracker.save_file, 'w') as f:
+        f.write(lines[0] + lines[1].replace('[', '[ "2023-07-01 10:00:00", ', 1) + ''.join(lines[2:]))
+    tracker.reload()
+    assert tracker.habits['workout'].tasks['run_10_miles'][0] == "2023-07-01 10:00:00"
+    assert Storage.habit_entry(tracker.habits['reading']) == expected['reading']
+
+
+# saves habits as a binary snapshot, maps it on load and copies the completions of a task only when it changes
+def test_binary_store(tmp_path, monkeypatch, sample_file, fresh_tracker):
+    monkeypatch.setattr(tracker, 'backend', 'binary')
+    monkeypatch.setattr(tracker, 'save_file', str(tmp_path / 'hbtracker_save.bin'))
+    tracker.load_from_file()
+    tracker.import_json(sample_file)
+    expected = {name: Storage.habit_entry(habit) for name, habit in tracker.habits.items()}
+    streaks = {name: habit.calculate_streak() for name, habit in tracker.habits.items()}
+    tracker.save_to_file()
+
+    tracker.reload()
+    assert {name: habit.calculate_streak() for name, habit in tracker.habits.items()} == streaks
+    assert not any(habit.is_loaded() for habit in tracker.habits.values())
+    assert {name: Storage.habit_entry(habit) for name, habit in tracker.habits.items()} == expected
+    stamps = tracker.habits['workout'].completions('run_10_miles')
+    assert isinstance(stamps, memoryview) and stamps.readonly
+
+    tracker.check_task('workout', 'run_10_miles')
+    assert not isinstance(tracker.habits['workout'].completions('run_10_miles'), memoryview)
+    assert isinstance(tracker.habits['workout'].completions('stretch'), memoryview)
+    expected['workout'] = Storage.habit_entry(tracker.habits['workout'])
+    tracker.reload()
+    assert {name: Storage.habit_entry(habit) for name, habit in tracker.habits.items()} == expected
+    tracker.compact()
+    tracker.reload()
+    assert {name: Storage.habit_entry(habit) for name, habit in tracker.habits.items()} == expected
+
+    # the json export can be edited by hand and imported again
+    tracker.export_json(str(tmp_path / 'export.json'))
+    with open(tmp_path / 'export.json') as f:
+        assert json.load(f)[0]['tasks']['run_10_miles'][0] == '2023-08-01 15:40:31'
+    monkeypatch.setattr(tracker, 'habits', {})
+    tracker.import_json(str(tmp_path / 'export.json'))
+    assert {name: Storage.habit_entry(habit) for name, habit in tracker.habits.items()} == expected
+
+
+# shares a save file with a second store - its completions are merged, its other changes and snapshots reload the
+# habits, nothing is written while it holds the lock and saving keeps its changes
+def test_shared_store(fresh_tracker):
+    tracker.load_from_file()
+    tracker.add_habit('workout', 7)
+    tracker.add_task('workout', 'run')
+    tracker.save_to_file()
+
+    other = {}
+    store = Storage.JournalStore(tracker.save_file)
+    store.load(other)
+    stamp = other['workout'].creation_seconds + 3600
+    record = {'op': 'checkTask', 'habit': 'workout', 'task': 'run', 'time': stamp}
+    Storage.apply_record(other, record)
+    store.write(record)
+    tracker.check_task('workout', 'run')
+    assert tracker.sync_changes() == [Output.Result('changesMerged', completions=1)]
+    assert len(tracker.habits['workout'].completions('run')) == 2
+
+    for record in store.changes():
+        Storage.apply_record(other, record)
+    record = {'op': 'addTask', 'habit': 'workout', 'task': 'stretch'}
+    Storage.apply_record(other, record)
+    store.write(record)
+    store.compact(other)
+    assert tracker.sync_changes() == [Output.Result('saveFileReloaded')]
+    assert list(tracker.habits['workout'].tasks) == ['run', 'stretch']
+    assert len(tracker.habits['workout'].completions('run')) == 2
+
+    if Storage.fcntl is not None:
+        with store.locked():
+            thread = threading.Thread(target=tracker.check_task, args=('workout', 'stretch'))
+            thread.start()
+            thread.join(0.2)
+            assert thread.is_alive()
+        thread.join()
+    tracker.store.start_autosave(0.01)
+    tracker.check_task('workout', 'run')
+    for _ in range(200):
+        if store.changes():
+            break
+        threading.Event().wait(0.01)
+    else:
+        assert False, 'the autosave thread did not write the change'
+    tracker.save_to_file()
+    tracker.close_store()
+    store.close()
+
+    habits = {}
+    Storage.JournalStore(tracker.save_file).load(habits)
+    assert {name: Storage.habit_entry(habit) for name, habit in habits.items()} == \
+        {name: Storage.habit_entry(habit) for name, habit in tracker.habits.items()}
+    assert len(habits['workout'].completions('run')) == 3
+    assert len(habits['workout'].completions('stretch')) == 1
+
+
+# checks a task that a second store has just removed - the check is skipped when the journal is replayed, and a
+# task added by both stores keeps its completions
+def test_shared_store_removed_task(fresh_tracker):
+    tracker.load_from_file()
+    tracker.add_habit('workout', 7)
+    tracker.add_task('workout', 'run')
+    tracker.add_task('workout', 'stretch')
+    tracker.check_task('workout', 'stretch')
+    tracker.save_to_file()
+
+    other = {}
+    store = Storage.JournalStore(tracker.save_file)
+    store.load(other)
+    for record in [{'op': 'removeTask', 'habit': 'workout', 'task': 'run'},
+                   {'op': 'addTask', 'habit': 'workout', 'task': 'stretch'}]:
+        Storage.replay_record(other, record)
+        store.write(record)
+    assert len(other['workout'].completions('stretch')) == 1
+    assert tracker.check_task('workout', 'run').ok
+    assert tracker.sync_changes() == [Output.Result('saveFileReloaded')]
+    assert list(tracker.habits['workout'].tasks) == ['stretch']
+    assert len(tracker.habits['workout'].completions('stretch')) == 1
+    store.close()
+
+    assert tracker.reload().kind == 'loaded'
+    assert list(tracker.habits['workout'].tasks) == ['stretch']
+    tracker.close_store()
+
+
+# selects the longest and the current streaks from the streak summaries and compares them with sorting every streak
+def test_leaderboard(monkeypatch, capsys):
+    habits = generate_habits(200, 3, 1)
+    now = Streak.to_seconds(datetime(2025, 12, 30))
+    runs = Analytics.streak_runs(habits, now, vectorized=False)
+    ranked = sorted(((last - first + 1) * habits[name].period, -order, -first, name, [first, last])
+                    for order, (name, data) in enumerate(runs.items()) for first, last in data)[::-1]
+    assert Analytics.top_streaks(habits, 25, now) == [(name, run) for *key, name, run in ranked[:25]]
+    since, until = now - 120 * 86400, now - 90 * 86400
+    assert Analytics.top_streaks(habits, 10, now, period=7, since=since, until=until) == \
+        [(name, run) for *key, name, run in ranked if habits[name].period == 7 and
+         Analytics.overlaps(habits[name], run[0], run[1], since, until)][:10]
+    assert Analytics.longest_streak(habits) == Analytics.max_streak(habits, Analytics.streak_runs(habits))
+
+    current = Analytics.current_streaks(habits, 5, now)
+    for name, run in current:
+        assert run == runs[name][-1]
+        assert run[1] >= Streak.period_count(habits[name].creation_seconds, habits[name].period * 86400, now) - 2
+    assert [(last - first + 1) * habits[name].period for name, (first, last) in current] == \
+        sorted(((last - first + 1) * habits[name].period for name, (first, last) in current), reverse=True)
+
+    monkeypatch.setattr(tracker, 'habits', habits)
+    tracker.execute('leaderboard 2 --period 1')
+    tracker.execute('currentStreaks 1')
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 3 and lines[0].startswith('1. ') and lines[1].startswith('2. ')
+
+
+# analyses a lazily loaded habit from the day bitmaps in the save file without reading its completions
+def test_day_bitmaps(sample_file, fresh_tracker):
+    tracker.import_json(sample_file)
+    expected = {name: habit.calculate_streak() for name, habit in tracker.habits.items()}
+    tracker.save_to_file()
+
+    tracker.reload()
+    assert {name: habit.calculate_streak() for name, habit in tracker.habits.items()} == expected
+    assert not any(habit.is_loaded() for habit in tracker.habits.values())
+    bitmap = tracker.habits['workout'].day_bitmaps()['run_10_miles']
+    assert bitmap.days[0] & 1 and not any(bitmap.starts)
+
+    # check-ins keep the bitmaps up to date
+    habit = tracker.habits['workout']
+    habit.check_task('run_10_miles', Streak.to_seconds(datetime(2023, 8, 1, 1, 40, 31)) + 86400 * 7)
+    assert bitmap.starts[0] & 128
+    tracker.save_to_file()
+    tracker.reload()
+    assert tracker.habits['workout'].day_bitmaps()['run_10_miles'].starts[0] & 128
+
+    # completions edited by hand no longer match the checksum - the bitmaps are built from the completions again
+    with open(tracker.save_file) as f:
+        lines = f.readlines()
+    with open(tracker.save_file, 'w') as f:
+        f.write(lines[0] + lines[1].replace('1690904431', '1690904432', 1) + ''.join(lines[2:]))
+    tracker.reload()
+    assert tracker.habits['workout'].day_bitmaps()['run_10_miles'].days[0] & 1
+    assert tracker.habits['workout'].is_loaded()
+
+
+# runs of a habit computed from every single completion, independent of the day bitmaps and the bulk analysis
+def reference_runs(habit, now):
+    state = Streak.StreakState(habit.creation_seconds, habit.period * 86400)
+    for task in habit.tasks:
+        state.set_task(task, habit.completions(task))
+    return state.streaks(now)
+
+
+# checks that the numpy and the pure python analysis return the same streaks as the completions, for habits in memory
+# and for lazily loaded habits that are analysed from their day bitmaps, and keep them as streak summaries
+@pytest.mark.parametrize('vectorized', [False, True])
+def test_bulk_analysis(vectorized, sample_file, fresh_tracker):
+    if vectorized and Analytics.np is None:
+        pytest.skip('numpy is not installed')
+    tracker.import_json(sample_file)
+    tracker.add_habit('notaskhabit', 3)
+    tracker.habits['notaskhabit'].creation_date = "2023-08-01 12:00:00"
+    tracker.add_habit('futurehabit', 1)
+    tracker.habits['futurehabit'].creation_date = "2999-01-01 00:00:00"
+    tracker.add_habit('boundaryhabit', 2)
+    tracker.habits['boundaryhabit'].creation_date = "2023-01-01 00:00:00"
+    tracker.habits['boundaryhabit'].tasks = {'task1': ["2023-01-03 00:00:00", "2022-12-31 10:00:00",
+                                                       "2023-01-05 00:00:00", "2023-01-05 20:00:00"],
+                                             'task2': ["2023-01-02 12:00:00", "2023-01-05 00:00:00"]}
+    now = Streak.to_seconds(datetime.now())
+    expected = {name: reference_runs(habit, now) for name, habit in tracker.habits.items()}
+
+    data = Analytics.streak_runs(tracker.habits, now, vectorized=vectorized)
+    assert data == expected
+    assert Analytics.max_streak(tracker.habits, data)[0] == 'notaskhabit'
+    assert all(habit.has_streak_state() for habit in tracker.habits.values())
+
+    tracker.compact()
+    tracker.reload()
+    assert Analytics.streak_runs(tracker.habits, now, vectorized=vectorized) == expected
+    assert not any(habit.is_loaded() for habit in tracker.habits.values())
+    assert Analytics.uncached(tracker.habits) == {}
+
+
+# builds the streak summaries of lazily loaded habits in the worker pool from their day bitmaps - the next analysis
+# takes them from the summaries without the pool
+def test_parallel_analysis(monkeypatch, sample_file, fresh_tracker):
+    monkeypatch.setattr(Analytics, 'workers', 2)
+    tracker.import_json(sample_file)
+    now = Streak.to_seconds(datetime.now())
+    expected = {name: reference_runs(habit, now) for name, habit in tracker.habits.items()}
+    tracker.save_to_file()
+    tracker.reload()
+    try:
+        assert Analytics.parallel_runs(tracker.habits, now, threshold=0) == expected
+        assert not any(habit.is_loaded() for habit in tracker.habits.values())
+        assert Analytics.uncached(tracker.habits) == {}
+        Analytics.pool.shutdown()
+        Analytics.pool = None
+        assert Analytics.parallel_runs(tracker.habits, now, threshold=0) == expected
+        assert Analytics.pool is None
+    finally:
+        if Analytics.pool is not None:
+            Analytics.pool.shutdown()
+            Analytics.pool = None
+
+
+# checks that the benchmark data generator always produces the same habits
+def test_generate_habits():
+    first = generate_habits(5, 3, 1, seed=1)
+    second = generate_habits(5, 3, 1, seed=1)
+    assert [Storage.habit_entry(habit) for habit in first.values()] == \
+           [Storage.habit_entry(habit) for habit in second.values()]
+    assert all(len(habit.tasks) == 3 for habit in first.values())
+    assert generate_habits(5, 3, 1, seed=2)['habit_0'].creation_date != first['habit_0'].creation_date
+
+
+# parses the fixed timestamp layout like strptime, falls back to strptime for other layouts and formats it back
+def test_timestamps():
+    Time.clear_caches()
+    for value in ['2023-08-01 15:40:31', '1970-01-01 00:00:00', '2024-02-29 23:59:59', '1969-12-31 23:59:59',
+                  '2023-8-1 5:04:03']:
+        expected = Streak.to_seconds(datetime.strptime(value, '%Y-%m-%d %H:%M:%S'))
+        assert Time.parse_timestamp(value) == Time.parse_timestamp(value) == expected
+        assert Time.format_timestamp(expected) == \
+            datetime.strptime(value, '%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%d %H:%M:%S')
+    assert Time.cached_parse.cache_info().hits == 5
+    for value in ['2023-02-29 10:00:00', '2023-08-01T15:40:31', '2023-08-01 15:40:31.5', 'yesterday']:
+        with pytest.raises(ValueError):
+            Time.parse_timestamp(value)
+    assert Time.parse_date('2023-08-01') == tracker.to_day('2023-8-1') == 19570
+    assert Time.period_boundary(0, 7, 2) == datetime(1970, 1, 15)
+
+
+# measures the memory of a habit with three tasks - task names read from a save file are separate strings until
+# they are interned, the creation date is kept in seconds
+def test_habit_memory():
+    count = 2000
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    habits = {}
+    for number in range(count):
+        habit = Habit('habit_' + str(number), 1)
+        habit.creation_date = '2023-08-01 10:00:00'
+        habit.tasks = {json.loads('"task_' + str(task) + '"'): [] for task in range(3)}
+        habits[habit.name] = habit
+    per_habit = (tracemalloc.get_traced_memory()[0] - before) / count
+    tracemalloc.stop()
+
+    assert per_habit < 800
+    assert not hasattr(habits['habit_0'], '__dict__')
+    assert list(habits['habit_0'].tasks)[0] is list(habits['habit_1'].tasks)[0]
+    assert habits['habit_0'].creation_seconds == Streak.to_seconds(datetime(2023, 8, 1, 10))
+    assert habits['habit_0'].creation_date == '2023-08-01 10:00:00'
+
+
+# collects latencies and counters only while statistics are enabled
+def test_stats(monkeypatch, capsys, fresh_tracker):
+    monkeypatch.setattr(Stats, 'enabled', False)
+    Stats.reset()
+    tracker.execute('addHabit statshabit 1')
+    assert Stats.latencies == {} and Stats.counters == {}
+
+    tracker.execute('stats on')
+    tracker.execute('addTask statshabit task1')
+    tracker.habits['statshabit'].tasks['task1'] = ["2023-08-01 15:40:31"]
+    tracker.execute('analyze statshabit')
+    tracker.execute('analyze statshabit')
+    tracker.execute('save')
+    assert Stats.latencies['analyze'].count == 2
+    assert Stats.counters['timestamps parsed'] >= 1
+    assert Stats.counters['completions indexed'] == 1
+    assert Stats.counters['bytes written'] == os.path.getsize(tracker.save_file)
+
+    capsys.readouterr()
+    tracker.execute('stats')
+    assert 'analyze' in capsys.readouterr().out
+    result, profile = Stats.profile(lambda: tracker.execute('analyze statshabit'))
+    assert result.kind == 'analysis'
+    assert 'calculate_streak' in [name for path, line, name in profile.stats]
+    tracker.execute('profile analyze statshabit')
+    assert 'function calls' in capsys.readouterr().out
+    Stats.reset()
+
+    # a command keeps at most reservoir_size latencies, its count and maximum stay exact
+    for number in range(3 * Stats.reservoir_size):
+        Stats.record_latency('getAllHabits', number / 1000)
+    latencies = Stats.latencies['getAllHabits']
+    assert len(latencies.samples) == Stats.reservoir_size and latencies.count == 3 * Stats.reservoir_size
+    assert Stats.summary()['getAllHabits']['max_ms'] == 3 * Stats.reservoir_size - 1
+    Stats.reset()
+
+
+# imports completions from csv and jsonl files and runs a command script with a single write at the end
+def test_batch(tmp_path, fresh_tracker):
+    tracker.load_from_file()
+    script = tmp_path / 'script.txt'
+    script.write_text('# set up a habit\naddHabit batchhabit 1\naddTask batchhabit task1\n\naddTask batchhabit task2\n')
+    tracker.run_script(str(script), quiet=True)
+    assert list(tracker.habits['batchhabit'].tasks) == ['task1', 'task2']
+    assert len((tmp_path / 'hbtracker_save.journal').read_text().splitlines()) == 3
+
+    (tmp_path / 'events.csv').write_text('habit,task,timestamp\n'
+                                         'batchhabit,task1,2023-08-02 10:00:00\n'
+                                         'batchhabit,task1,1690884000\n'
+                                         'batchhabit,unknown,2023-08-02 10:00:00\n')
+    (tmp_path / 'events.jsonl').write_text('{"habit": "batchhabit", "task": "task2", "time": "2023-08-01 09:00:00"}\n'
+                                           '{"habit": "batchhabit", "task": "task1", "time": 1690880000}\n')
+    tracker.import_completions(str(tmp_path / 'events.csv'))
+    tracker.import_completions(str(tmp_path / 'events.jsonl'))
+    assert list(tracker.habits['batchhabit'].tasks['task1']) == ["2023-08-01 08:53:20", "2023-08-01 10:00:00",
+                                                                 "2023-08-02 10:00:00"]
+    assert len((tmp_path / 'hbtracker_save.journal').read_text().splitlines()) == 6
+
+    expected = Storage.habit_entry(tracker.habits['batchhabit'])
+    tracker.reload()
+    assert Storage.habit_entry(tracker.habits['batchhabit']) == expected
+
+    # an import inside a script joins the batch of the script - nothing is written before the script ends
+    script.write_text('addHabit nestedhabit 1\naddTask nestedhabit task1\nimportCompletions ' +
+                      str(tmp_path / 'nested.csv') + '\naddTask nestedhabit task2\n')
+    (tmp_path / 'nested.csv').write_text('nestedhabit,task1,2023-08-02 10:00:00\n')
+    tracker.run_script(str(script), quiet=True)
+    assert tracker.pending_changes is None
+    assert len((tmp_path / 'hbtracker_save.journal').read_text().splitlines()) == 10
+    expected = Storage.habit_entry(tracker.habits['nestedhabit'])
+    assert expected['tasks'] == {'task1': [1690970400], 'task2': []}
+    tracker.reload()
+    assert Storage.habit_entry(tracker.habits['nestedhabit']) == expected
+
+
+# answers period, task and date lookups from the indexes and keeps them up to date with every change
+def test_index(sample_file, fresh_tracker):
+    tracker.load_from_file()
+    tracker.import_json(sample_file)
+    assert not os.path.exists(sample_file + '.lock')
+    tracker.reload()
+
+    day = tracker.get_completions_on('2023-08-01')['completions']
+    expected = sorted((stamp, habit.name, task) for habit in tracker.habits.values() for task in habit.tasks
+                      for stamp in habit.completions(task) if stamp // 86400 == tracker.to_day('2023-08-01'))
+    assert day and day == [{'time': stamp, 'habit': habit, 'task': task} for stamp, habit, task in expected]
+
+    tracker.add_habit('indexhabit', 3)
+    tracker.add_task('indexhabit', 'run_10_miles')
+    tracker.check_task('indexhabit', 'run_10_miles')
+    assert tracker.find_task('run_10_miles')['habits'] == ['workout', 'indexhabit']
+    today = datetime.now().strftime('%Y-%m-%d')
+    assert tracker.get_completions_between(today, today)['completions'][-1]['habit'] == 'indexhabit'
+
+    tracker.remove_habit('workout')
+    tracker.remove_task('indexhabit', 'run_10_miles')
+    assert tracker.find_task('run_10_miles') == Output.error('There is no habit with that task!')
+    assert tracker.get_completions_between(today, today)['completions'] == []
+    by_period = {}
+    for habit in tracker.habits.values():
+        by_period.setdefault(habit.period, []).append(habit.name)
+    assert tracker.get_habits_by_period()['periods'] == [{'period': period, 'habits': by_period[period]}
+                                                         for period in sorted(by_period)]
+
+
+# renders the results of a script as json lines, in quiet mode only the errors, in one write per command
+def test_output_modes(tmp_path, monkeypatch, capsys, fresh_tracker):
+    monkeypatch.setattr(Output, 'mode', 'json')
+    script = tmp_path / 'script.txt'
+    script.write_text('addHabit outputhabit 2\naddTask outputhabit task1\naddTask nohabit task1\n'
+                      'getAllTasks outputhabit\n')
+    result = tracker.run_script(str(script))
+    assert result.kind == 'scriptRun' and result['commands'] == 4
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [line['type'] for line in lines] == ['habitAdded', 'taskAdded', 'error', 'tasks']
+    assert lines[0]['period'] == 2 and lines[3]['tasks'] == ['task1']
+
+    Output.mode = 'quiet'
+    tracker.execute('getAllHabits')
+    tracker.execute('removeHabit nohabit')
+    assert capsys.readouterr().out == '[Error] There is no habit with that name!\n'
+
+    Output.mode = 'human'
+    writes = []
+    monkeypatch.setattr(Output, 'flush_threshold', 1 << 20)
+    monkeypatch.setattr(Output.sys.stdout, 'write', writes.append)
+    tracker.execute('analyze outputhabit')
+    assert len(writes) == 1 and writes[0].startswith('Here is the analysis for your outputhabit Habit\n')
+
+    # both longest streak reports show the periods the same way
+    streak = {'habit': 'outputhabit', 'period': 2, 'days': 8, 'periods': 4, 'start': '2023-08-01 10:00:00',
+              'end': '2023-08-09 10:00:00', 'ongoing': False}
+    assert '1 week and 1 day (4.0 Period(s))' in Output.human(Output.Result('maxStreak', **streak))[0]
+    assert '1 week and 1 day (4.0 Period(s))' in Output.human(Output.Result('maxStreakAll', **streak))[1]
+    assert tracker.time_unit_conversion(-1) == 'Input must be a non-negative number of days.'
+
+
+# serves a journal store on localhost - concurrent check-ins are written in groups and survive a reload
+def test_server(tmp_path, monkeypatch):
+    monkeypatch.setattr(Storage, 'compact_threshold', 2000)
+    store = Storage.JournalStore(str(tmp_path / 'hbtracker_save.json'))
+    server = Server.Server({}, store)
+    loop = asyncio.new_event_loop()
+    listener = loop.run_until_complete(server.listen('127.0.0.1', 0))
+    port = listener.sockets[0].getsockname()[1]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    def call(method, path, data=None, connection=None):
+        connection = connection or http.client.HTTPConnection('127.0.0.1', port)
+        connection.request(method, path, json.dumps(data) if data is not None else None)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+
+    try:
+        assert call('POST', '/habits', {'name': 'serverhabit', 'period': 1})[0] == 201
+        assert call('POST', '/habits', {'name': 'serverhabit', 'period': 1})[0] == 409
+        assert call('POST', '/habits', {'name': 'other habit', 'period': 'x'})[0] == 400
+        assert call('POST', '/habits/serverhabit/tasks', {'task': 'task1'})[0] == 201
+        assert call('POST', '/habits/missing/tasks', {'task': 'task1'})[0] == 404
+        assert call('GET', '/habits/serverhabit/tasks') == (200, ['task1'])
+        assert call('POST', '/habits/serverhabit/tasks/task1/check', {'time': '2023-08-01 10:00:00'}) == \
+            (201, {'habit': 'serverhabit', 'task': 'task1', 'time': '2023-08-01 10:00:00'})
+
+        # every client checks in over its own keep-alive connection, enough records to trigger a compaction
+        def client(number):
+            connection = http.client.HTTPConnection('127.0.0.1', port)
+            for index in range(20):
+                assert call('POST', '/habits/serverhabit/tasks/task1/check', {}, connection)[0] == 201
+            connection.close()
+        clients = [threading.Thread(target=client, args=(number,)) for number in range(4)]
+        for thread_ in clients:
+            thread_.start()
+        for thread_ in clients:
+            thread_.join()
+
+        status, data = call('GET', '/habits/serverhabit/analysis')
+        assert status == 200
+        assert [(streak['periods'], streak['ongoing']) for streak in data['streaks']] == [(1, True)]
+        assert call('GET', '/streaks/max')[1]['habit'] == 'serverhabit'
+        assert [streak['habit'] for streak in call('GET', '/streaks/top?k=3')[1]] == ['serverhabit']
+        assert call('GET', '/streaks/current?period=7')[1] == []
+        assert call('GET', '/unknown')[0] == 404
+
+        # while another process holds the save file lock, check-ins wait for it but other requests are answered
+        if Storage.fcntl is not None:
+            other = Storage.JournalStore(str(tmp_path / 'hbtracker_save.json'))
+            with other.locked():
+                checker = threading.Thread(target=call, args=('POST', '/habits/serverhabit/tasks/task1/check', {}))
+                checker.start()
+                checker.join(0.2)
+                assert checker.is_alive()
+                assert call('GET', '/habits') == (200, ['serverhabit'])
+            checker.join()
+            other.close()
+    finally:
+        async def stop():
+            listener.close()
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        asyncio.run_coroutine_threadsafe(stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+    assert os.path.exists(tmp_path / 'hbtracker_save.json')
+    expected = Storage.habit_entry(server.habits['serverhabit'])
+    assert len(expected['tasks']['task1']) == (82 if Storage.fcntl is not None else 81)
+    store.close()
+    habits = {}
+    Storage.JournalStore(str(tmp_path / 'hbtracker_save.json')).load(habits)
+    assert Storage.habit_entry(habits['serverhabit']) == expected
@@ -1,17 +1,130 @@
 import os.path
+import time
 from datetime import datetime
 import json
 import argparse
+import TrackerAnalytics as Analytics
+import TrackerBatch as Batch
 import TrackerExceptions as Exceptions
+import TrackerIndex as Index
+import TrackerOutput as Output
+import TrackerServer as Server
+import TrackerStats as Stats
+import TrackerStorage as Storage
+import TrackerStreak as Streak
+import TrackerTime as Time
 from TrackerHabit import Habit
 
-# global Error / Warning sign
-err = '[Error]'
-war = '[Warning] '
+# global Error / Warning sign and the days formatting - rendering has moved to TrackerOutput, they stay available here
+err = Output.err
+war = Output.war
+time_unit_conversion = Output.time_unit_conversion
+
+# storage backend (json or sqlite) and save file location - changes are written to the store once it has been
+# loaded or saved
+backend = 'json'
+save_file = 'hbtracker_save.json'
+store = None
+
+# time in seconds the last load_from_file call took
+load_time = 0
+
+# seconds without a change after which the autosave thread writes the changes - 0 writes every change at once
+autosave_delay = 0
+
+# changes collected while a batch runs - written to the store at once when the outermost batch ends
+pending_changes = None
+batch_depth = 0
 
 # init habits array - stores all habits loaded into memory
 habits = {}
 
+# secondary indexes (habits by period and task, completions by day) - updated with every change
+index = Index.HabitIndex()
+
+
+# updates the indexes with a change, writes it to the open store and folds the journal into the snapshot once it
+# gets too large
+def record_change(record):
+    index.apply(record)
+    if store is not None:
+        if pending_changes is not None:
+            pending_changes.append(record)
+            return
+        store.write(record)
+        if store.needs_compaction():
+            compact_store()
+
+
+# merges the changes other processes have written to the save file since this process last looked at it
+# their completions are added to the habits in memory, any other change reloads the habits from the save file -
+# the changes of this process are written before, so they are part of what is loaded
+# returns a list of results (empty if nothing has changed)
+def sync_changes():
+    results = []
+    if store is None:
+        return results
+    if store.error is not None:
+        results.append(Output.error('Autosave failed: ' + str(store.error)))
+        store.error = None
+    records = store.changes()
+    if records == []:
+        return results
+    if records is not None and all(record['op'] in Storage.merged_operations for record in records):
+        merged = 0
+        for record in records:
+            if Storage.replay_record(habits, record):
+                index.apply(record)
+                merged += len(record['times']) if 'times' in record else 1
+        results.append(Output.Result('changesMerged', completions=merged))
+        return results
+    store.flush()
+    habits.clear()
+    store.reload(habits)
+    index.rebuild(habits)
+    results.append(Output.Result('saveFileReloaded'))
+    return results
+
+
+# writes all changes, merges those of other processes and folds the journal into a new snapshot - the save file
+# stays locked throughout, so no other process can write in between
+# returns the results of the merge
+def compact_store():
+    flush_changes()
+    with store.locked():
+        store.flush()
+        results = sync_changes()
+        store.compact(habits)
+    return results
+
+
+# starts collecting changes instead of writing each of them - batches nest, a batch started inside another one
+# adds its changes to those of the outer batch
+def begin_batch():
+    global pending_changes, batch_depth
+    if batch_depth == 0:
+        pending_changes = []
+    batch_depth += 1
+
+
+# writes the changes collected so far in one go - the batch goes on collecting afterwards
+def flush_changes():
+    if store is not None and pending_changes:
+        store.write_many(pending_changes)
+        pending_changes.clear()
+
+
+# ends a batch - the outermost batch writes all changes collected since its begin_batch and stops collecting
+def end_batch():
+    global pending_changes, batch_depth
+    batch_depth -= 1
+    if batch_depth > 0:
+        return
+    flush_changes()
+    pending_changes = None
+    if store is not None and store.needs_compaction():
+        compact_store()
+
 
 # adds a habit
 def add_habit(name, period):
@@ -20,9 +133,12 @@ def add_habit(name, period):
             raise Exceptions.ElementAlreadyExists('A Habit with that name already exists!')
         else:
             habits[name] = Habit(name, period)
-            print('Added Habit: ' + name)
+            record_change({'op': 'addHabit', 'name': name, 'period': habits[name].period,
+                           'creation_date': habits[name].creation_date})
+            return Output.Result('habitAdded', name=name, period=habits[name].period,
+                                 creation_date=habits[name].creation_date)
     except Exception as e:
-        print(err, str(e))
+        return Output.error(str(e))
 
 
 # removes a habit
@@ -30,11 +146,12 @@ def remove_habit(name):
     try:
         if name in habits:
             del habits[name]
-            print('Deleted Habit ' + name)
+            record_change({'op': 'removeHabit', 'name': name})
+            return Output.Result('habitRemoved', name=name)
         else:
             raise Exceptions.ElementNotFound('There is no habit with that name!')
     except Exception as e:
-        print(err, str(e))
+        return Output.error(str(e))
 
 
 # wrapper function to add a task to a habit
@@ -44,8 +161,10 @@ def add_task(habit, task):
             raise Exceptions.ElementNotFound('There is no habit with that name!')
         else:
             habits[habit].add_task(task)
+            record_change({'op': 'addTask', 'habit': habit, 'task': task})
+            return Output.Result('taskAdded', habit=habit, task=task)
     except Exception as e:
-        print(err, str(e))
+        return Output.error(str(e))
 
 
 # wrapper function to remove a task from a habit
@@ -55,8 +174,10 @@ def remove_task(habit, task):
             raise Exceptions.ElementNotFound('There is no habit with that name!')
         else:
             habits[habit].remove_task(task)
+            record_change({'op': 'removeTask', 'habit': habit, 'task': task})
+            return Output.Result('taskRemoved', habit=habit, task=task)
     except Exception as e:
-        print(err, str(e))
+        return Output.error(str(e))
 
 
 # wrapper function to check off a task in a habit
@@ -65,165 +186,322 @@ def check_task(habit, task):
         if habit not in habits:
             raise Exceptions.ElementNotFound('There is no habit with that name!')
         else:
-            habits[habit].check_task(task)
+            stamp = Streak.to_seconds(datetime.now())
+            habits[habit].check_task(task, stamp)
+            record_change({'op': 'checkTask', 'habit': habit, 'task': task, 'time': stamp})
+            return Output.Result('taskChecked', habit=habit, task=task, time=stamp)
     except Exception as e:
-        print(err, str(e))
+        return Output.error(str(e))
 
 
-# prints list of all habits stored in habits dict
+# returns the names of all habits stored in habits dict
 def get_all_habits():
-    print(list(habits.keys()))
+    return Output.Result('habits', habits=list(habits))
 
 
-# prints all periods and their associated habits
+# returns all periods and their associated habits
 def get_habits_by_period():
-    # loop through all stored habits and extract periods
-    unique_periods = set(habit.period for habit in habits.values())
+    return Output.Result('habitsByPeriod', periods=[{'period': period, 'habits': filtered_habits}
+                                                    for period, filtered_habits in index.habits_by_period()])
+
+
+# returns all habits that have a task with the given name
+def find_task(task):
+    try:
+        names = index.habits_with_task(task)
+        if not names:
+            raise Exceptions.ElementNotFound('There is no habit with that task!')
+        return Output.Result('habitsWithTask', task=task, habits=names)
+    except Exception as e:
+        return Output.error(str(e))
+
 
-    # loop through set of unique periods to extract habit names
-    for period in sorted(unique_periods):
-        filtered_habits = [habit.name for habit in habits.values() if habit.period == period]
-        print('Habits with Period ' + str(period) + ': ' + str(filtered_habits))
+# converts a Y-m-d date into days since the epoch
+def to_day(date):
+    return Time.parse_date(date)
 
 
-# prints all tasks for a habit
+# returns all completions on a day
+def get_completions_on(date):
+    return get_completions_between(date, date)
+
+
+# returns all completions from the first to the last day (both included) in the order they were made
+def get_completions_between(start, end):
+    try:
+        completions = index.completions_between(habits, to_day(start), to_day(end))
+        return Output.Result('completions', start=start, end=end,
+                             completions=[{'time': stamp, 'habit': habit, 'task': task}
+                                          for stamp, habit, task in completions])
+    except Exception as e:
+        return Output.error(str(e))
+
+
+# returns all tasks for a habit
 def get_all_tasks(habit):
     try:
         if habit not in habits:
             raise Exceptions.ElementNotFound('There is no habit with that name!')
         else:
-            habits[habit].get_all_tasks()
+            return Output.Result('tasks', habit=habit, tasks=habits[habit].get_all_tasks())
     except Exception as e:
-        print(err, str(e))
-
-
-# helper function that takes days as input and converts them into weeks / months
-def time_unit_conversion(days):
-    if days < 0:
-        return "Input must be a non-negative number of days."
-
-    weeks, remaining_days = divmod(days, 7)
-
-    if weeks > 0 and remaining_days > 0:
-        return f"{weeks} week{'s' if weeks > 1 else ''} and {remaining_days} day{'s' if remaining_days > 1 else ''}"
-    elif weeks > 0:
-        return f"{weeks} week{'s' if weeks > 1 else ''}"
-    elif days > 0:
-        return f"{days} day{'s' if days > 1 else ''}"
-    else:
-        return "0 days"
+        return Output.error(str(e))
 
 
-# prints analysis data for a habit
+# returns analysis data for a habit
 def get_analysis(habit):
     try:
         if habit not in habits:
             raise Exceptions.ElementNotFound('There is no habit with that name!')
         else:
-            streaks = habits[habit].calculate_streak()
-            print('Here is the analysis for your ' + habit + ' Habit')
-            print('-------------------------------------')
-            print('This Habit has ' + str(len(streaks)) + ' Streaks')
-            print('-------------------------------------')
-            for n in range(0, len(streaks)):
-                print('--- Streak Number: ' + str(n + 1) + ' ---')
-                print('Streak Start: ' + str(streaks[n][0]))
-                print('Streak Duration: ' + time_unit_conversion(streaks[n][1] * habits[habit].period) + ' (' + str(
-                    streaks[n][1]) + ' Periods)')
-                # print Ongoing instead of date in the future
-                if streaks[n][2] > datetime.now():
-                    streaks[n][2] = 'Ongoing'
-                print('Streak End: ' + str(streaks[n][2]))
+            return analysis_result(habits[habit], habits[habit].calculate_streak())
     except Exception as e:
-        print(err, str(e))
+        return Output.error(str(e))
 
 
-# prints analysis data to find the longest streak between all habits
+# returns analysis data for all habits as a list of results - the habits are analysed in parallel if there is
+# enough data
+def get_analysis_all():
+    try:
+        data = Analytics.parallel_runs(habits)
+        return [analysis_result(habit, habit.to_streaks(data[habit.name])) for habit in habits.values()]
+    except Exception as e:
+        return Output.error(str(e))
+
+
+# builds the streak report of a habit
+def analysis_result(habit, streaks):
+    return Output.Result('analysis', habit=habit.name, period=habit.period,
+                         streaks=[Output.streak_data(habit, streak) for streak in streaks])
+
+
+# returns analysis data to find the longest streak between all habits
 def get_max_streak_all():
-    top_streak = {'days': 0}
-    for habit in habits:
-        # streaks[habits[habit].name] = habits[habit].calculate_streak()
-        data = habits[habit].calculate_streak()
-        for streaks in data:
-            streak_days = streaks[1] * habits[habit].period
-            if streak_days > top_streak['days']:
-                top_streak['days'] = streak_days
-                top_streak['habit'] = habits[habit].name
-                top_streak['period'] = habits[habit].period
-                top_streak['start'] = streaks[0]
-                top_streak['end'] = streaks[2]
-
-    print('The Longest Streak was your ' + top_streak['habit'] + ' Habit')
-    print(
-        'It lasted for ' + time_unit_conversion(top_streak['days']) + ' (' + str(
-            round(top_streak['days'] / top_streak['period'], 2)) + ' Period(s))')
-    print('Beginning on ' + datetime.strftime(top_streak['start'],
-                                              '%Y-%m-%d %H:%M:%S') + ' and Ending on ' + datetime.strftime(
-        top_streak['end'], '%Y-%m-%d %H:%M:%S'))
-
-
-# prints max streak for a single habit
+    top_streak = Analytics.longest_streak(habits)
+    if top_streak is None:
+        return Output.Result('noStreaks')
+    habit = habits[top_streak[0]]
+    streak = habit.to_streaks([top_streak[1:]])[0]
+    return Output.Result('maxStreakAll', habit=habit.name, period=habit.period, **Output.streak_data(habit, streak))
+
+
+# returns max streak for a single habit - the longest run comes first in the ranking of the streak summary
 def get_max_streak_single(habit):
-    top_streak = {'days': 0}
-    data = habits[habit].calculate_streak()
-    for streaks in data:
-        streak_days = streaks[1] * habits[habit].period
-        if streak_days > top_streak['days']:
-            top_streak['days'] = streak_days
-            top_streak['period'] = habits[habit].period
-            top_streak['start'] = streaks[0]
-            top_streak['end'] = streaks[2]
-
-    print('The Longest Streak in your ' + habit + ' Habit lasted for ' + time_unit_conversion(
-        top_streak['days']) + ' (' + str(round(top_streak['days'] / top_streak['period'], 2)) + ' Period(s))')
-    print('Beginning on ' + datetime.strftime(top_streak['start'],
-                                              '%Y-%m-%d %H:%M:%S') + ' and Ending on ' + datetime.strftime(
-        top_streak['end'], '%Y-%m-%d %H:%M:%S'))
-
-
-# converts data in habits dict to json and saves to file
+    try:
+        if habit not in habits:
+            raise Exceptions.ElementNotFound('There is no habit with that name!')
+        ranked = habits[habit].streak_state().ranked(Streak.to_seconds(datetime.now()))[2]
+        if not ranked:
+            return Output.Result('noStreaks')
+        streak = habits[habit].to_streaks(ranked[:1])[0]
+        return Output.Result('maxStreak', habit=habit, period=habits[habit].period,
+                             **Output.streak_data(habits[habit], streak))
+    except Exception as e:
+        return Output.error(str(e))
+
+
+# returns the k longest streaks over all habits - optionally only of habits with a period or of streaks that
+# overlap the days from since until until (Y-m-d, both included)
+def leaderboard(k=10, period=None, since=None, until=None):
+    try:
+        if k < 1:
+            raise ValueError('The number of streaks must be at least 1')
+        first = to_day(since) * 86400 if since is not None else None
+        last = (to_day(until) + 1) * 86400 - 1 if until is not None else None
+        entries = Analytics.top_streaks(habits, k, period=period, since=first, until=last)
+        return Output.Result('leaderboard', streaks=streak_list(entries))
+    except Exception as e:
+        return Output.error(str(e))
+
+
+# returns the streaks that can still be continued, longest first
+def current_streaks(k=None, period=None):
+    try:
+        if k is not None and k < 1:
+            raise ValueError('The number of streaks must be at least 1')
+        entries = Analytics.current_streaks(habits, k, period=period)
+        return Output.Result('currentStreaks', streaks=streak_list(entries))
+    except Exception as e:
+        return Output.error(str(e))
+
+
+# converts (habit name, [first period, last period]) streaks into their json form
+def streak_list(entries):
+    return [dict(Output.streak_data(habits[name], habits[name].to_streaks([run])[0]), habit=name)
+            for name, run in entries]
+
+
+# opens the store of the save file if no save file has been loaded yet
+def open_store():
+    global store
+    if store is None:
+        store = Storage.backends[backend](save_file)
+    return store
+
+
+# converts data in habits dict to json and saves to file - folds the journal into a new snapshot
 def save_to_file():
-    data = []
     try:
         for habit in habits:
-            data.append(
-                {'name': habits[habit].name, 'period': habits[habit].period,
-                 'creation_date': habits[habit].creation_date,
-                 'tasks': habits[habit].tasks})
             if not habits[habit].tasks:
                 raise Exceptions.IncompleteHabit('Could not save! --> Tasks for one or more habits are empty.')
 
-        with open('hbtracker_save.json', 'w') as f:
-            json.dump(data, f)
-        f.close()
-        print('Saved!')
+        open_store()
+        return compact_store() + [Output.Result('saved')]
     except Exception as e:
-        print(err, str(e))
+        return Output.error(str(e))
 
 
-# looks for save file - uses json information to create all habit objects and store them in habits array
+# folds the journal into a new snapshot (or rewrites the database) without validating the habits
+def compact():
+    try:
+        open_store()
+        return compact_store() + [Output.Result('compacted')]
+    except Exception as e:
+        return Output.error(str(e))
+
+
+# looks for save file - reads the snapshot, replays the journal and stores all habits in habits array
 # creates new save file of none is found
 def load_from_file():
-    # overwirte error handling
-    if os.path.exists('hbtracker_save.json'):
-        print('Loading Save Data from file...')
-        with open('hbtracker_save.json', 'r') as f:
-            data = json.load(f)
-        f.close()
-        for entry in data:
-            habit = Habit(entry['name'], entry['period'])
-            habit.creation_date = entry['creation_date']
-            habit.tasks = entry['tasks']
-            habits[habit.name] = habit
+    global store, load_time
+    if store is not None:
+        flush_changes()
+        store.close()
+    store = Storage.backends[backend](save_file)
+    if store.exists():
+        try:
+            start = time.perf_counter()
+            version = store.load(habits)
+            load_time = time.perf_counter() - start
+            # version 1 and 2 save files have been written again in the current format while loading
+            result = Output.Result('loaded', habits=len(habits), ms=round(load_time * 1000, 1),
+                                   complete=sum(habit.is_loaded() for habit in habits.values()),
+                                   converted_from=version if version is not None and version < store.version
+                                   else None)
+        except Exceptions.SaveFileError as e:
+            # do not journal changes against a save file that could not be read
+            store.close()
+            store = None
+            result = Output.error(str(e))
     else:
-        print(war + 'No Save File found!')
+        result = Output.Result('noSaveFile')
+    if store is not None and autosave_delay:
+        store.start_autosave(autosave_delay)
+    index.rebuild(habits)
+    return result
+
+
+# writes the changes that are still buffered and closes the save file
+def close_store():
+    global store
+    if store is not None:
+        flush_changes()
+        store.close()
+        store = None
+
+
+# imports all habits of a json save file (and its journal) into the current store - existing habits are skipped
+def import_json(file):
+    try:
+        if not os.path.exists(file):
+            raise Exceptions.ElementNotFound('There is no save file with that name!')
+        results = []
+        imported = {}
+        # the source is only read - no lock is taken and its journal is left as it is
+        source = Storage.JournalStore(file, read_only=True)
+        try:
+            source.load(imported)
+            for name in imported:
+                if name in habits:
+                    results.append(Output.Result('habitSkipped', name=name))
+                    continue
+                # building the entry loads the habit completely, so the source file can be closed afterwards
+                entry = Storage.habit_entry(imported[name])
+                habits[name] = imported[name]
+                record_change(dict(entry, op='addHabit'))
+                results.append(Output.Result('habitImported', name=name))
+        finally:
+            source.close()
+        return results
+    except Exception as e:
+        return Output.error(str(e))
+
+
+# writes all habits to a json file in the original save file format - a list of habits with timestamp strings that
+# can be edited by hand and read again with importJson
+def export_json(file):
+    try:
+        data = [{'name': habit.name, 'period': habit.period, 'creation_date': habit.creation_date,
+                 'tasks': {task: list(habit.tasks[task]) for task in habit.tasks}} for habit in habits.values()]
+        with open(file, 'w') as f:
+            json.dump(data, f, indent=2)
+        return Output.Result('exported', habits=len(data), file=file)
+    except Exception as e:
+        return Output.error(str(e))
+
+
+# imports completions from a csv or jsonl file of (habit, task, timestamp) events
+# every (habit, task) pair is checked once and its completions are stored as one sorted run and one change record
+def import_completions(file):
+    try:
+        start = time.perf_counter()
+        groups = Batch.group_events(file)
+        results = []
+        imported = 0
+        skipped = 0
+        begin_batch()
+        try:
+            for (habit, task), stamps in groups.items():
+                if habit not in habits or task not in habits[habit].tasks:
+                    results.append(Output.Result('completionsSkipped', habit=habit, task=task, count=len(stamps)))
+                    skipped += len(stamps)
+                    continue
+                habits[habit].add_completions(task, stamps)
+                record_change({'op': 'importCompletions', 'habit': habit, 'task': task, 'times': sorted(stamps)})
+                imported += len(stamps)
+        finally:
+            end_batch()
+        elapsed = time.perf_counter() - start
+        results.append(Output.Result('completionsImported', imported=imported, skipped=skipped,
+                                     seconds=round(elapsed, 3),
+                                     events_per_second=round((imported + skipped) / elapsed)))
+        return results
+    except Exception as e:
+        return Output.error(str(e))
+
+
+# runs every line of a command script - changes are written to the save file once at the end
+# quiet only shows the errors of the commands
+def run_script(file, quiet=False):
+    try:
+        with open(file) as f:
+            lines = [line.strip() for line in f]
+        commands = [line for line in lines if line and not line.startswith('#')]
+        start = time.perf_counter()
+        mode = Output.mode
+        if quiet and mode == 'human':
+            Output.mode = 'quiet'
+        begin_batch()
+        try:
+            with Output.scope():
+                for line in commands:
+                    execute(line)
+        finally:
+            end_batch()
+            Output.mode = mode
+        elapsed = time.perf_counter() - start
+        return Output.Result('scriptRun', commands=len(commands), seconds=round(elapsed, 3),
+                             commands_per_second=round(len(commands) / elapsed))
+    except Exception as e:
+        return Output.error(str(e))
 
 
-# clears habit array and reloads data from save file
+# clears habit array and reloads data from save file and journal
 # initially used for debugging, left in because it might be useful for testing
 def reload():
     habits.clear()
-    load_from_file()
+    return load_from_file()
 
 
 # wrapper function to clear the screen - quality of life feature
@@ -236,9 +514,8 @@ def join_arguments(args):
     return ' '.join(args)
 
 
-# main method that handles user input and command mapping
-def main():
-    # parsers used to handle commands with parameters
+# parsers used to handle commands with parameters
+def build_parser():
     parser = argparse.ArgumentParser(prog='Habit Tracker', description='Habit Tracker 1.0')
     subparsers = parser.add_subparsers(title='Commands', dest='command')
 
@@ -270,32 +547,144 @@ def main():
     parser_checktask = subparsers.add_parser('getMaxStreak', help='Calculates the maximum streak for a Habit')
     parser_checktask.add_argument('habit')
 
+    parser_leaderboard = subparsers.add_parser('leaderboard', help='Returns the longest streaks over all Habits')
+    parser_leaderboard.add_argument('k', nargs='?', type=int, default=10, help='number of streaks (default: 10)')
+    parser_leaderboard.add_argument('--period', type=int, help='only Habits with this period')
+    parser_leaderboard.add_argument('--from', dest='since', metavar='DATE', help='only streaks after this date (Y-m-d)')
+    parser_leaderboard.add_argument('--to', dest='until', metavar='DATE', help='only streaks before this date (Y-m-d)')
+
+    parser_currentstreaks = subparsers.add_parser('currentStreaks',
+                                                  help='Returns the streaks that can still be continued')
+    parser_currentstreaks.add_argument('k', nargs='?', type=int, help='number of streaks (default: all)')
+    parser_currentstreaks.add_argument('--period', type=int, help='only Habits with this period')
+
+    parser_findtask = subparsers.add_parser('findTask', help='Returns all Habits that have a Task')
+    parser_findtask.add_argument('task')
+
+    parser_completionson = subparsers.add_parser('getCompletionsOn', help='Returns all completions on a date (Y-m-d)')
+    parser_completionson.add_argument('date')
+
+    parser_completionsbetween = subparsers.add_parser('getCompletionsBetween',
+                                                      help='Returns all completions between two dates (Y-m-d)')
+    parser_completionsbetween.add_argument('start')
+    parser_completionsbetween.add_argument('end')
+
+    parser_importjson = subparsers.add_parser('importJson', help='Imports all Habits from a json save file')
+    parser_importjson.add_argument('file')
+
+    parser_exportjson = subparsers.add_parser('exportJson', help='Exports all Habits to a json file')
+    parser_exportjson.add_argument('file')
+
+    parser_importcompletions = subparsers.add_parser('importCompletions',
+                                                     help='Imports completions from a csv or jsonl file')
+    parser_importcompletions.add_argument('file')
+
+    parser_stats = subparsers.add_parser('stats', help='Shows command timings and counters')
+    parser_stats.add_argument('action', nargs='?', choices=['on', 'off', 'reset'],
+                              help='turns the collection on or off or clears the collected numbers')
+
+    parser_profile = subparsers.add_parser('profile', help='Runs a command under the profiler')
+    parser_profile.add_argument('command_line', nargs=argparse.REMAINDER)
+
     # subparsers used to handle commands that do not require parameters
     subparsers.add_parser('reload', help='reload save file')
     subparsers.add_parser('getMaxStreakAll', help='Calculates the maximum streak between all Habits')
+    subparsers.add_parser('analyzeAll', help='Calculates all streaks for every Habit')
     subparsers.add_parser('getAllHabits', help='Returns all stored Habits')
     subparsers.add_parser('getHabitsByPeriod', help='Returns Lists of Habits sorted by period')
     subparsers.add_parser('save', help='Saves data to file')
+    subparsers.add_parser('compact', help='Folds the journal into the save file')
     subparsers.add_parser('clear', help='Clear the screen')
+    return parser
+
+
+# returns or changes the collected statistics
+def show_stats(action=None):
+    if action == 'on':
+        Stats.enabled = True
+        return Output.Result('statsEnabled')
+    elif action == 'off':
+        Stats.enabled = False
+        return Output.Result('statsDisabled')
+    elif action == 'reset':
+        Stats.reset()
+        return Output.Result('statsCleared')
+    else:
+        return Output.Result('stats', enabled=Stats.enabled, load_ms=round(load_time * 1000, 1),
+                             commands=Stats.summary(), counters=dict(Stats.counters))
+
+
+# runs a command under cProfile and returns the functions that took the most time
+def profile_command(command_line):
+    if not command_line:
+        return Output.error('Usage: profile <command...>')
+    result, stats = Stats.profile(lambda: execute(join_arguments(command_line)))
+    return Output.Result('profile', text=Stats.profile_text(stats))
+
+
+# dict stores mappings for commands to corresponding functions
+commandFunctionMapping = {
+    'reload': reload,
+    'getAllHabits': get_all_habits,
+    'getHabitsByPeriod': get_habits_by_period,
+    'getAllTasks': get_all_tasks,
+    'findTask': find_task,
+    'getCompletionsOn': get_completions_on,
+    'getCompletionsBetween': get_completions_between,
+    'addHabit': add_habit,
+    'removeHabit': remove_habit,
+    'save': save_to_file,
+    'compact': compact,
+    'importJson': import_json,
+    'exportJson': export_json,
+    'importCompletions': import_completions,
+    'clear': clear_screen,
+    'addTask': add_task,
+    'removeTask': remove_task,
+    'checkTask': check_task,
+    'analyze': get_analysis,
+    'getMaxStreakAll': get_max_streak_all,
+    'analyzeAll': get_analysis_all,
+    'getMaxStreak': get_max_streak_single,
+    'leaderboard': leaderboard,
+    'currentStreaks': current_streaks,
+    'stats': show_stats,
+    'profile': profile_command,
+}
+
+parser = build_parser()
+
+
+# parses a single command line, runs the mapped function and emits its result - records its latency if statistics
+# are enabled
+# returns the result of the function (None for invalid commands)
+def execute(userInput):
+    with Output.scope():
+        if userInput.split()[0] not in commandFunctionMapping:
+            Output.emit(Output.Result('invalidCommand', command=userInput.split()[0]))
+            return None
+        # batches write their changes at the end and merge those of other processes then
+        if pending_changes is None:
+            Output.emit(sync_changes())
+        try:
+            args = parser.parse_args(userInput.split())
+        except SystemExit:
+            return None
+        function = commandFunctionMapping[args.command]
+        function_args = vars(args)
+        command = function_args.pop('command')
+        if Stats.enabled:
+            start = time.perf_counter()
+            result = function(**function_args)
+            Stats.record_latency(command, time.perf_counter() - start)
+        else:
+            result = function(**function_args)
+        Output.emit(result)
+        return result
 
-    # dict stores mappings for commands to corresponding functions
-    commandFunctionMapping = {
-        'reload': reload,
-        'getAllHabits': get_all_habits,
-        'getHabitsByPeriod': get_habits_by_period,
-        'getAllTasks': get_all_tasks,
-        'addHabit': add_habit,
-        'removeHabit': remove_habit,
-        'save': save_to_file,
-        'clear': clear_screen,
-        'addTask': add_task,
-        'removeTask': remove_task,
-        'checkTask': check_task,
-        'analyze': get_analysis,
-        'getMaxStreakAll': get_max_streak_all,
-        'getMaxStreak': get_max_streak_single,
-    }
 
+# main method that handles user input
+def main():
     # main loop that handles user input
     while True:
         userInput = input('HabitTracker> ')
@@ -306,21 +695,53 @@ def main():
         elif userInput == 'help' or userInput == '-h' or userInput == '--help':
             parser.print_help()
         else:
-            if userInput.split()[0] in commandFunctionMapping:
-                try:
-                    args = parser.parse_args(userInput.split())
-                    function = commandFunctionMapping[args.command]
-                    function_args = vars(args)
-                    function_args.pop('command')
-                    function(**function_args)
-                except SystemExit:
-                    pass
-            else:
-                print('Invalid Command')
+            execute(userInput)
 
 
 # program startup function - loads save file and hands off to main loop
 if __name__ == '__main__':
-    print('### HabitTracker 1.0 ###')
-    load_from_file()
-    main()
+    startup_parser = argparse.ArgumentParser(prog='tracker.py', description='Habit Tracker 1.0')
+    startup_parser.add_argument('--storage', choices=sorted(Storage.backends), default='json',
+                                help='storage backend (default: json)')
+    startup_parser.add_argument('--file', help='save file (default: hbtracker_save.json, .bin or .db)')
+    startup_parser.add_argument('--workers', type=int, help='worker processes for analyses over all habits '
+                                                            '(default: one per cpu, 1 disables parallel analysis)')
+    startup_parser.add_argument('--stats', action='store_true', help='collect command timings and counters')
+    startup_parser.add_argument('--batch', metavar='SCRIPT', help='runs the commands in a script and exits')
+    startup_parser.add_argument('--import', dest='import_file', metavar='FILE',
+                                help='imports completions from a csv or jsonl file and exits')
+    startup_parser.add_argument('--quiet', action='store_true', help='hides the output of the commands in a script')
+    startup_parser.add_argument('--output', choices=Output.modes, default='human',
+                                help='human readable messages, one json object per result and line or only errors '
+                                     '(default: human)')
+    startup_parser.add_argument('--serve', action='store_true', help='serves the habits over a local http/json api')
+    startup_parser.add_argument('--host', default='127.0.0.1', help='address the api server listens on')
+    startup_parser.add_argument('--port', type=int, default=8080, help='port the api server listens on (default: 8080)')
+    startup_parser.add_argument('--autosave', type=float, default=1, metavar='SECONDS',
+                                help='writes changes in the background once none has been made for this long '
+                                     '(default: 1, 0 writes every change at once)')
+    startup_args = startup_parser.parse_args()
+    Analytics.workers = startup_args.workers
+    Stats.enabled = startup_args.stats
+    Output.mode = startup_args.output
+    backend = startup_args.storage
+    save_file = startup_args.file or Storage.default_files[backend]
+    # scripts, imports and the api server write their changes in batches already
+    if not (startup_args.batch or startup_args.import_file or startup_args.serve):
+        autosave_delay = startup_args.autosave
+
+    if Output.mode == 'human':
+        print('### HabitTracker 1.0 ###')
+    Output.emit(load_from_file())
+    if startup_args.batch or startup_args.import_file:
+        if startup_args.import_file:
+            Output.emit(import_completions(startup_args.import_file))
+        if startup_args.batch:
+            Output.emit(run_script(startup_args.batch, startup_args.quiet))
+    elif startup_args.serve:
+        Server.serve(habits, store, startup_args.host, startup_args.port)
+    else:
+        try:
+            main()
+        finally:
+            close_store()